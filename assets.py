@@ -0,0 +1,184 @@
+import base64
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+from urllib.request import Request, urlopen
+
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIRECTORY = "dist"
+MANIFEST_NAME = "manifest.json"
+# Fingerprinted names never change content, browsers may keep them for a year without revalidating
+IMMUTABLE_MAX_AGE = 31536000
+COMPRESSIBLE = {".css", ".js", ".svg", ".ico", ".json", ".txt", ".map"}
+# Third-party files downloaded by `flask vendor-assets`, checked against the same SRI hashes as the CDN tags
+VENDORED = {
+    "vendor/bootstrap.min.css": ("https://cdn.jsdelivr.net/npm/bootstrap@5.2.2/dist/css/bootstrap.min.css",
+                                 "sha384-Zenh87qX5JnK2Jl0vWa8Ck2rdkQ2Bzep5IDxbcnCeuOxjzrPF/et3URy9Bv1WTRi"),
+    "vendor/bootstrap.bundle.min.js": ("https://cdn.jsdelivr.net/npm/bootstrap@5.2.2/dist/js/bootstrap.bundle.min.js",
+                                       "sha384-OERcA2EqjJCMA+/3y+gxIOqMEjwtxJY7qPCqsdltbNJuaOe923+mo//f6V8Qbsw3"),
+}
+GOOGLE_FONTS = "https://fonts.googleapis.com/css2?family=Cinzel:wght@800&family=Poppins&display=swap"
+# Google serves woff2 only to browsers it recognises
+FONTS_USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/107.0 Safari/537.36"
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+
+def download(url, user_agent=None):
+    headers = {"User-Agent": user_agent} if user_agent else {}
+    with urlopen(Request(url, headers=headers), timeout=30) as response:
+        return response.read()
+
+
+def vendor(static_folder):
+    # Copies the CDN files into static/vendor so the build can fingerprint and compress them with ours
+    for name, (url, integrity) in VENDORED.items():
+        content = download(url)
+        algorithm, expected = integrity.split("-", 1)
+        if base64.b64encode(hashlib.new(algorithm, content).digest()).decode() != expected:
+            raise ValueError(f"{url} doesn't match its integrity hash")
+        write_file(os.path.join(static_folder, name), content)
+    css = download(GOOGLE_FONTS, FONTS_USER_AGENT).decode("utf8")
+
+    def localize(match):
+        font_name = hashlib.sha1(match.group(2).encode("utf8")).hexdigest()[:16] + os.path.splitext(match.group(2))[1]
+        write_file(os.path.join(static_folder, "vendor", "fonts", font_name), download(match.group(2)))
+        return f"url(fonts/{font_name})"
+    write_file(os.path.join(static_folder, "vendor", "fonts.css"), CSS_URL.sub(localize, css).encode("utf8"))
+
+
+def minify_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    # Not around ":", "a :hover" and "a:hover" are different selectors
+    css = re.sub(r"\s*([{};,>])\s*", r"\1", css)
+    css = re.sub(r":\s+", ":", css)
+    return css.replace(";}", "}").strip()
+
+
+def fingerprint(name, content):
+    root, extension = os.path.splitext(name)
+    return f"{root}.{hashlib.sha256(content).hexdigest()[:12]}{extension}"
+
+
+def build(static_folder):
+    # Writes every static file to static/dist under a content hashed name, with .gz and .br variants,
+    # and the logical name -> hashed name manifest. CSS is minified and its url() references rewritten.
+    output = os.path.join(static_folder, BUILD_DIRECTORY)
+    sources = []
+    for directory, subdirectories, files in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(static_folder):
+            subdirectories[:] = [name for name in subdirectories if name != BUILD_DIRECTORY]
+        for file_name in files:
+            path = os.path.join(directory, file_name)
+            sources.append(os.path.relpath(path, static_folder).replace(os.sep, "/"))
+    # Stylesheets last, the files they reference must have their hashed name already
+    sources.sort(key=lambda name: (name.endswith(".css"), name))
+    shutil.rmtree(output, ignore_errors=True)
+    manifest = {}
+    for name in sources:
+        with open(os.path.join(static_folder, name), "rb") as file:
+            content = file.read()
+        if name.endswith(".css"):
+            content = rewrite_css(name, content.decode("utf8"), manifest).encode("utf8")
+        manifest[name] = fingerprint(name, content)
+        target = os.path.join(output, manifest[name])
+        write_file(target, content)
+        if os.path.splitext(name)[1] in COMPRESSIBLE:
+            write_compressed(target, content)
+    write_file(os.path.join(output, MANIFEST_NAME), json.dumps(manifest, indent=1, sort_keys=True).encode("utf8"))
+    return manifest
+
+
+def rewrite_css(name, css, manifest):
+    directory = os.path.dirname(name)
+
+    def hashed(match):
+        reference = match.group(2)
+        if "://" in reference or reference.startswith(("data:", "/", "#")):
+            return match.group()
+        target = os.path.normpath(os.path.join(directory, reference.split("?")[0])).replace(os.sep, "/")
+        if target not in manifest:
+            return match.group()
+        return f"url({os.path.relpath(manifest[target], directory or '.').replace(os.sep, '/')})"
+    css = CSS_URL.sub(hashed, css)
+    return css if name.endswith(".min.css") else minify_css(css)
+
+
+def write_compressed(path, content):
+    # Only kept when smaller, serve() falls back to the plain file
+    variants = [(".gz", gzip.compress(content, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append((".br", brotli.compress(content, quality=11)))
+    for extension, compressed in variants:
+        if len(compressed) < len(content):
+            write_file(path + extension, compressed)
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as file:
+        file.write(content)
+
+
+class Assets:
+    # Resolves static file names to their fingerprinted copy (`asset_url` in templates) and serves those with
+    # far-future caching and the precompressed variant the browser accepts. Without a build, asset_url falls
+    # back to the plain /static URL.
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.version = None
+        self.directory = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.directory = os.path.join(app.static_folder, BUILD_DIRECTORY)
+        self.load()
+        app.add_url_rule("/assets/<path:filename>", "assets", self.serve)
+        app.jinja_env.globals.update(asset_url=self.url, has_asset=self.has)
+
+    def load(self):
+        try:
+            with open(os.path.join(self.directory, MANIFEST_NAME), "rb") as file:
+                content = file.read()
+        except OSError:
+            self.manifest, self.version = {}, None
+            return
+        self.manifest = json.loads(content)
+        self.version = hashlib.sha1(content).hexdigest()
+
+    def has(self, filename):
+        return filename in self.manifest
+
+    def url(self, filename):
+        if filename in self.manifest:
+            return url_for("assets", filename=self.manifest[filename])
+        return url_for("static", filename=filename)
+
+    def serve(self, filename):
+        if filename == MANIFEST_NAME:
+            return abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        encodings = request.accept_encodings
+        for encoding, extension in (("br", ".br"), ("gzip", ".gz")):
+            if encodings[encoding] and os.path.isfile(os.path.join(self.directory, filename + extension)):
+                response = send_from_directory(self.directory, filename + extension, mimetype=mimetype,
+                                               max_age=IMMUTABLE_MAX_AGE)
+                response.content_encoding = encoding
+                break
+        else:
+            response = send_from_directory(self.directory, filename, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
@@ -0,0 +1,350 @@
+"""Seeds a database with generated content and times the site's routes, in process and over HTTP.
+
+    python benchmark.py --posts 2000 --save baseline.json
+    python benchmark.py --posts 2000 --baseline baseline.json --tolerance 0.2
+    python benchmark.py --database postgresql://localhost/portfolio_bench --reset --mode http --clients 20
+
+Without --database a throwaway SQLite file is used. An existing database is emptied and reseeded, which is
+only done with --reset. The "client" mode goes through Flask's test client and counts every query itself,
+the "http" mode starts `gunicorn main:app` on --port and reads the X-Query-Count header (queries run while a
+streamed page is sent aren't in it). Mail is never sent, the outbox is only written to (MAIL_SENDER=off).
+
+Every route reports p50/p95/p99 latency, queries per request and requests per second. --save writes them to
+a JSON file, --baseline compares the run against one and exits with 1 when p95 latency or throughput got
+worse by more than --tolerance, or a route runs more queries than it did.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import loadtest
+
+# method, path and form data of a request, from the seeded ids and the client's csrf token
+Route = namedtuple("Route", ["name", "authenticated", "expected_status", "make_request"])
+PASSWORD = "benchmark"
+WORDS = ("will power truth morality value eternal return overman spirit camel lion child abyss dance "
+         "music tragedy reason instinct herd noble slave master suffering joy laughter solitude friend "
+         "enemy god dead madman mountain sea sun shadow wanderer philosopher free becoming being").split()
+
+
+def seed(main, volumes, rng):
+    # Bulk inserts through the core, a few thousand rows per statement
+    from werkzeug.security import generate_password_hash
+    db = main.db
+    db.drop_all()
+    db.create_all()
+    main.seed_maximes()
+    now = datetime.utcnow()
+    # Hashing is slow on purpose, every user shares one hash
+    password = generate_password_hash(PASSWORD)
+    insert(db, main.User, [{"email": f"user{number}@example.com", "password": password, "name": f"User {number}"}
+                           for number in range(volumes.users)])
+    user_ids = ids(db, main.User)
+    insert(db, main.BlogCategory, [{"name": f"Category {number}", "description": "Generated category",
+                                    "ordering": "natural" if number % 2 else "id"}
+                                   for number in range(volumes.categories)])
+    category_ids = ids(db, main.BlogCategory)
+    insert(db, main.Tag, [{"name": f"tag{number}"} for number in range(volumes.tags)])
+    tag_ids = ids(db, main.Tag)
+
+    posts = []
+    for number in range(volumes.posts):
+        title = f"{rng.choice(WORDS).capitalize()} §{number}"
+        body = "".join(f"<p>{' '.join(rng.choices(WORDS, k=60))}.</p>" for _ in range(5))
+        rendered = main.content.render(body, trusted=True)
+        posts.append({"title": title, "sort_key": main.utils.natural_sort_key(title),
+                      "subtitle": " ".join(rng.choices(WORDS, k=8)), "body": body, "body_html": rendered.html,
+                      "body_text": rendered.text, "excerpt": rendered.excerpt, "word_count": rendered.word_count,
+                      "reading_minutes": rendered.reading_minutes, "date": date.today() - timedelta(days=number),
+                      "updated_at": now, "header": number % 50 == 0, "category_id": rng.choice(category_ids),
+                      "author_id": user_ids[0]})
+    insert(db, main.BlogPost, posts)
+    post_ids = ids(db, main.BlogPost)
+    insert(db, main.tag_link, [{"post_id": post_id, "tag_id": tag_id} for post_id in post_ids
+                               for tag_id in rng.sample(tag_ids, min(volumes.tags_per_post, len(tag_ids)))])
+    comments = [" ".join(rng.choices(WORDS, k=20)) for _ in range(len(post_ids) * volumes.comments)]
+    insert(db, main.Comment, [{"author_id": rng.choice(user_ids), "post_id": post_ids[number // volumes.comments],
+                               "text": text, "html": main.content.sanitize(text), "date": date.today()}
+                              for number, text in enumerate(comments)])
+
+    insert(db, main.ToDoProject, [{"author_id": user_ids[0], "name": f"Project {number}",
+                                   "description": "Generated project"} for number in range(volumes.projects)])
+    project_ids = ids(db, main.ToDoProject)
+    insert(db, main.ToDo, [{"author_id": user_ids[0], "project_id": project_id, "title": f"Task {project_id}-{number}",
+                            "description": " ".join(rng.choices(WORDS, k=6)), "date": now.strftime("%d/%m/%Y"),
+                            "body": " ".join(rng.choices(WORDS, k=40)), "priority": rng.randrange(3),
+                            "status": rng.randrange(2)}
+                           for project_id in project_ids for number in range(volumes.todos)])
+    db.session.commit()
+    result = main.app.test_cli_runner().invoke(args=["rebuild-tag-stats"])
+    if result.exit_code:
+        raise RuntimeError(result.output)
+    main.page_cache.clear()
+    return {"posts": post_ids, "categories": category_ids, "tags": tag_ids, "projects": project_ids}
+
+
+def insert(db, model, rows, batch=2000):
+    table = getattr(model, "__table__", model)
+    for start in range(0, len(rows), batch):
+        db.session.execute(table.insert(), rows[start:start + batch])
+
+
+def ids(db, model):
+    return list(db.session.execute(db.select(model.id).order_by(model.id)).scalars())
+
+
+def make_routes(seeded, rng):
+    posts, categories, tags, projects = seeded["posts"], seeded["categories"], seeded["tags"], seeded["projects"]
+    # The first user, the one every project belongs to
+    credentials = {"email": "user0@example.com", "password": PASSWORD}
+    return [
+        Route("home", False, 200, lambda token: ("GET", "/", None)),
+        Route("blog_categories", False, 200, lambda token: ("GET", "/blog", None)),
+        Route("show_post", False, 200, lambda token: ("GET", f"/post/{rng.choice(posts)}", None)),
+        Route("show_category", False, 200, lambda token: ("GET", f"/category/{rng.choice(categories)}", None)),
+        Route("show_tags", False, 200, lambda token: ("GET", "/tags", None)),
+        Route("show_tag", False, 200, lambda token: ("GET", f"/tag/{rng.choice(tags)}", None)),
+        Route("search", False, 200, lambda token: ("GET", f"/search?q={rng.choice(WORDS)}", None)),
+        Route("login", False, 200, lambda token: ("GET", "/login", None)),
+        Route("login_post", False, 302, lambda token: ("POST", "/login", dict(credentials, csrf_token=token))),
+        Route("show_post_logged_in", True, 200, lambda token: ("GET", f"/post/{rng.choice(posts)}", None)),
+        Route("show_todo", True, 200, lambda token: ("GET", f"/todo-list/{rng.choice(projects)}", None)),
+        Route("show_profile", True, 200, lambda token: ("GET", "/profile.html", None)),
+        Route("comment_post", True, 302,
+              lambda token: ("POST", f"/post/{rng.choice(posts)}",
+                             {"body": " ".join(rng.choices(WORDS, k=12)), "csrf_token": token})),
+    ], credentials
+
+
+def scrape_csrf_token(html):
+    marker = 'name="csrf_token" type="hidden" value="'
+    start = html.find(marker)
+    if start == -1:
+        return None
+    start += len(marker)
+    return html[start:html.find('"', start)]
+
+
+class ClientDriver:
+    # In process, one request at a time, counting the queries on the engine
+    name = "client"
+
+    def __init__(self, main):
+        from sqlalchemy import event
+        self.app = main.app
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.query_count = 0
+
+        def count(*args):
+            self.query_count += 1
+        with self.app.app_context():
+            event.listen(main.db.engine, "before_cursor_execute", count)
+
+    def session(self, credentials=None):
+        client = self.app.test_client()
+        if credentials:
+            client.post("/login", data=credentials)
+        return client, None
+
+    def send(self, client, method, path, data):
+        before = self.query_count
+        response = client.open(path, method=method, data=data)
+        # Streamed pages run queries until the last chunk
+        response.get_data()
+        response.close()
+        return response.status_code, self.query_count - before
+
+
+class HttpDriver:
+    # A real gunicorn, queries read from the X-Query-Count header
+    name = "http"
+
+    def __init__(self, base_url):
+        import requests
+        self.base_url = base_url
+        self.requests = requests
+
+    def session(self, credentials=None):
+        session = self.requests.Session()
+        # The token belongs to the session, every form of the site accepts it
+        token = scrape_csrf_token(session.get(self.base_url + "/login").text)
+        if credentials:
+            session.post(self.base_url + "/login", data=dict(credentials, csrf_token=token), allow_redirects=False)
+        return session, token
+
+    def send(self, session, method, path, data):
+        response = session.request(method, self.base_url + path, data=data, allow_redirects=False, timeout=60)
+        return response.status_code, int(response.headers.get("X-Query-Count", 0))
+
+
+def run_route(driver, route, credentials, requests_count, clients, warmup):
+    latencies, queries, errors = [], [], [0]
+    lock = threading.Lock()
+    remaining = [requests_count]
+
+    def client():
+        session, token = driver.session(credentials if route.authenticated else None)
+        for _ in range(warmup):
+            driver.send(session, *route.make_request(token))
+        own_latencies, own_queries, own_errors = [], [], 0
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+                request = route.make_request(token)
+            started = time.perf_counter()
+            try:
+                status, query_count = driver.send(session, *request)
+            except Exception:
+                status, query_count = None, 0
+            own_latencies.append(time.perf_counter() - started)
+            own_queries.append(query_count)
+            own_errors += status != route.expected_status
+        with lock:
+            latencies.extend(own_latencies)
+            queries.extend(own_queries)
+            errors[0] += own_errors
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {"requests": len(latencies), "errors": errors[0], "rps": len(latencies) / elapsed if elapsed else 0,
+            "p50": loadtest.percentile(latencies, 0.50), "p95": loadtest.percentile(latencies, 0.95),
+            "p99": loadtest.percentile(latencies, 0.99),
+            "queries": sum(queries) / len(queries) if queries else 0}
+
+
+def format_result(mode, route_name, result):
+    return (f"{mode:<6} {route_name:<20} {result['requests']:>6} req {result['rps']:>8.1f} req/s  "
+            f"p50 {result['p50'] * 1000:>7.1f} ms  p95 {result['p95'] * 1000:>7.1f} ms  "
+            f"p99 {result['p99'] * 1000:>7.1f} ms  {result['queries']:>5.1f} q/req  {result['errors']} errors")
+
+
+def compare(results, baseline, tolerance):
+    # Returns the regressions, and prints every route next to its baseline
+    regressions = []
+    for mode, routes in results.items():
+        for route_name, result in routes.items():
+            before = baseline.get(mode, {}).get(route_name)
+            if before is None:
+                continue
+            p95_change = result["p95"] / before["p95"] - 1 if before["p95"] else 0
+            rps_change = result["rps"] / before["rps"] - 1 if before["rps"] else 0
+            print(f"{mode:<6} {route_name:<20} p95 {p95_change:>+7.1%}  req/s {rps_change:>+7.1%}  "
+                  f"q/req {before['queries']:.1f} -> {result['queries']:.1f}")
+            if p95_change > tolerance:
+                regressions.append(f"{mode} {route_name}: p95 {p95_change:+.1%}")
+            if rps_change < -tolerance:
+                regressions.append(f"{mode} {route_name}: req/s {rps_change:+.1%}")
+            if result["queries"] > before["queries"] + 0.5:
+                regressions.append(f"{mode} {route_name}: {before['queries']:.1f} -> {result['queries']:.1f} q/req")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database", help="SQLAlchemy URL of the database to seed (default: a temporary SQLite).")
+    parser.add_argument("--reset", action="store_true", help="Allow emptying the --database given.")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--categories", type=int, default=10)
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--tags", type=int, default=200)
+    parser.add_argument("--tags-per-post", type=int, default=4)
+    parser.add_argument("--comments", type=int, default=5, help="Comments per post.")
+    parser.add_argument("--projects", type=int, default=3)
+    parser.add_argument("--todos", type=int, default=100, help="Todos per project.")
+    parser.add_argument("--mode", choices=("client", "http", "both"), default="both")
+    parser.add_argument("--route", action="append", help="Only run this route, repeat for several.")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per route.")
+    parser.add_argument("--warmup", type=int, default=5, help="Unmeasured requests per client before each route.")
+    parser.add_argument("--clients", type=int, default=10, help="Concurrent clients in http mode.")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers in http mode.")
+    parser.add_argument("--worker-class", default="gevent", help="gunicorn worker class in http mode.")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--seed", type=int, default=1, help="Random seed of the content and of the requests.")
+    parser.add_argument("--save", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Compare against the results saved in this JSON file.")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression.")
+    arguments = parser.parse_args()
+    if arguments.database and not arguments.reset:
+        parser.error("--database is emptied and reseeded, pass --reset to confirm")
+    if arguments.todos > int(os.environ.get("TODO_MAX_TASKS", 100)):
+        parser.error("--todos is over TODO_MAX_TASKS")
+
+    # main reads its configuration when imported
+    database = arguments.database or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "benchmark.db")
+    os.environ["DATABASE_"] = database
+    os.environ.setdefault("SECRET_KEY", "benchmark")
+    os.environ["MAIL_SENDER"] = "off"
+    # Every login_post comes from the same address for the same account
+    os.environ.setdefault("LOGIN_THROTTLE", "off")
+    # Only to get the X-Query-Count header, never reached
+    os.environ["QUERY_BUDGET"] = "1000000"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main as site
+
+    rng = random.Random(arguments.seed)
+    started = time.perf_counter()
+    with site.app.app_context():
+        seeded = seed(site, arguments, rng)
+    print(f"Seeded {database} in {time.perf_counter() - started:.1f}s: {len(seeded['posts'])} posts, "
+          f"{len(seeded['tags'])} tags, {len(seeded['posts']) * arguments.comments} comments, "
+          f"{len(seeded['projects'])} projects of {arguments.todos} todos")
+
+    routes, credentials = make_routes(seeded, rng)
+    if arguments.route:
+        routes = [route for route in routes if route.name in arguments.route]
+    results = {}
+    if arguments.mode in ("client", "both"):
+        driver = ClientDriver(site)
+        results["client"] = {}
+        for route in routes:
+            results["client"][route.name] = run_route(driver, route, credentials, arguments.requests, 1,
+                                                      arguments.warmup)
+            print(format_result("client", route.name, results["client"][route.name]))
+    if arguments.mode in ("http", "both"):
+        base_url = f"http://127.0.0.1:{arguments.port}"
+        server = loadtest.start_gunicorn(arguments.worker_class, arguments.workers, arguments.port)
+        try:
+            loadtest.wait_until_up(base_url)
+            driver = HttpDriver(base_url)
+            results["http"] = {}
+            for route in routes:
+                results["http"][route.name] = run_route(driver, route, credentials, arguments.requests,
+                                                        arguments.clients, arguments.warmup)
+                print(format_result("http", route.name, results["http"][route.name]))
+        finally:
+            server.terminate()
+            server.wait()
+
+    if arguments.save:
+        volumes = {name: getattr(arguments, name) for name in ("users", "categories", "posts", "tags",
+                                                                 "tags_per_post", "comments", "projects", "todos")}
+        with open(arguments.save, "w") as file:
+            json.dump({"created_at": datetime.utcnow().isoformat(timespec="seconds"),
+                       "python": platform.python_version(), "database": database.split(":")[0],
+                       "volumes": volumes, "results": results}, file, indent=1, sort_keys=True)
+    if arguments.baseline:
+        with open(arguments.baseline) as file:
+            regressions = compare(results, json.load(file)["results"], arguments.tolerance)
+        if regressions:
+            print("Regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import gzip
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_TYPES = {"text/html", "text/css", "text/plain", "text/xml", "application/json",
+                      "application/javascript", "image/svg+xml"}
+
+
+class GzipStream:
+    def __init__(self, level):
+        # wbits 31: zlib stream with a gzip header and trailer
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        # Sync flush so every chunk reaches the browser as soon as it is rendered
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush()
+
+
+class BrotliStream:
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data) + self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class Compression:
+    # Compresses text responses with brotli or gzip after the view. Plain bodies below COMPRESS_MIN_SIZE are
+    # left alone, streamed ones are compressed chunk by chunk. The page cache serves the same bytes to many
+    # visitors: `cache_key()` names the body of such a response (None otherwise), its compressed bytes are kept
+    # in a small LRU under that name.
+    def __init__(self, app=None, cache_key=None):
+        self.cache_key = cache_key
+        self.config = None
+        self._bodies = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.config = app.config
+        app.config.setdefault('COMPRESS_MIN_SIZE', 1024)
+        app.config.setdefault('COMPRESS_CACHE_BYTES', 8 * 1024 * 1024)
+        app.config.setdefault('COMPRESS_GZIP_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BROTLI_QUALITY', 5)
+        app.after_request(self.compress)
+
+    def choose_encoding(self):
+        accepted = request.accept_encodings
+        if brotli is not None and accepted["br"]:
+            return "br"
+        if accepted["gzip"]:
+            return "gzip"
+        return None
+
+    def compressor(self, encoding):
+        if encoding == "br":
+            return BrotliStream(self.config['COMPRESS_BROTLI_QUALITY'])
+        return GzipStream(self.config['COMPRESS_GZIP_LEVEL'])
+
+    def compress(self, response):
+        if response.status_code != 200 or response.direct_passthrough or response.content_encoding \
+                or response.mimetype not in COMPRESSIBLE_TYPES:
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = self.choose_encoding()
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = self._compress_stream(response.response, encoding, response.charset)
+        else:
+            body = response.get_data()
+            if len(body) < self.config['COMPRESS_MIN_SIZE']:
+                return response
+            response.set_data(self._compress_body(body, encoding))
+        response.content_encoding = encoding
+        # The compressed bytes differ from the identity ones, only a weak validator still holds
+        etag, weak = response.get_etag()
+        if etag and not weak:
+            response.set_etag(etag, weak=True)
+        return response
+
+    def _compress_body(self, body, encoding):
+        body_key = self.cache_key() if self.cache_key is not None else None
+        if body_key is None:
+            return self._compress(body, encoding)
+        key = (encoding, body_key)
+        with self._lock:
+            compressed = self._bodies.get(key)
+            if compressed is not None:
+                self._bodies.move_to_end(key)
+                return compressed
+        compressed = self._compress(body, encoding)
+        with self._lock:
+            if key not in self._bodies:
+                self._bodies[key] = compressed
+                self._size += len(compressed)
+            while self._size > self.config['COMPRESS_CACHE_BYTES']:
+                self._size -= len(self._bodies.popitem(last=False)[1])
+        return compressed
+
+    def _compress(self, body, encoding):
+        if encoding == "br":
+            return brotli.compress(body, quality=self.config['COMPRESS_BROTLI_QUALITY'])
+        return gzip.compress(body, compresslevel=self.config['COMPRESS_GZIP_LEVEL'], mtime=0)
+
+    def _compress_stream(self, chunks, encoding, charset):
+        stream = self.compressor(encoding)
+        try:
+            for chunk in chunks:
+                data = stream.compress(chunk.encode(charset) if isinstance(chunk, str) else chunk)
+                if data:
+                    yield data
+            yield stream.finish()
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
@@ -0,0 +1,167 @@
+import math
+import re
+from collections import namedtuple
+from html import escape
+from html.parser import HTMLParser
+
+import utils
+
+# What a view needs of a CKEditor body, computed once when it is saved
+RenderedContent = namedtuple("RenderedContent", ["html", "text", "excerpt", "word_count", "reading_minutes"])
+ALLOWED_TAGS = {"a", "abbr", "b", "blockquote", "br", "caption", "cite", "code", "dd", "del", "div", "dl", "dt", "em",
+                "figcaption", "figure", "h1", "h2", "h3", "h4", "h5", "h6", "hr", "i", "img", "ins", "li", "mark",
+                "ol", "p", "pre", "q", "s", "small", "span", "strike", "strong", "sub", "sup", "table", "tbody", "td",
+                "tfoot", "th", "thead", "tr", "u", "ul"}
+VOID_TAGS = {"br", "hr", "img", "source"}
+# Dropped with everything inside, other unknown tags only lose the tag itself
+DROPPED_TAGS = {"script", "style", "iframe", "object", "embed", "form", "textarea", "select", "button", "svg", "math",
+                "template", "noscript"}
+ALLOWED_ATTRIBUTES = {"a": {"href", "title", "target"}, "img": {"src", "alt", "title", "width", "height"},
+                      "td": {"colspan", "rowspan"}, "th": {"colspan", "rowspan", "scope"}, "ol": {"start"}}
+# CKEditor aligns and sizes with inline styles, nothing that can load a resource
+ALLOWED_STYLES = {"text-align", "float", "width", "height", "margin", "margin-left", "margin-right", "color",
+                  "background-color", "font-size", "font-weight", "font-style", "text-decoration", "border", "padding"}
+URL_SCHEMES = {"http", "https", "mailto"}
+# Posts are written by the admin and keep what CKEditor embeds in them: iframes (videos, maps), audio and video,
+# class names and pasted images inlined as data: URIs. Comments get none of it.
+TRUSTED_TAGS = {"iframe", "video", "audio", "source"}
+TRUSTED_ATTRIBUTES = {"iframe": {"src", "width", "height", "title", "allow", "allowfullscreen", "frameborder"},
+                      "video": {"src", "poster", "controls", "width", "height", "loop", "muted"},
+                      "audio": {"src", "controls", "loop"}, "source": {"src", "type"}}
+BOOLEAN_ATTRIBUTES = {"allowfullscreen", "controls", "loop", "muted"}
+DATA_IMAGE = re.compile(r"data:image/(png|jpeg|gif|webp);base64,[a-z0-9+/=\s]*\Z", re.I)
+UNSAFE_STYLE_VALUE = re.compile(r"url\s*\(|expression\s*\(|\\|[<>]", re.I)
+EXCERPT_CHARS = 300
+WORDS_PER_MINUTE = 200
+
+
+def safe_url(url, data_image=False):
+    url = "".join(url.split())
+    if data_image and DATA_IMAGE.match(url):
+        return url
+    scheme = url.split(":", 1)[0].lower() if ":" in url.split("/", 1)[0] else None
+    return url if scheme is None or scheme in URL_SCHEMES else None
+
+
+def safe_style(style):
+    declarations = []
+    for declaration in style.split(";"):
+        name, _, value = declaration.partition(":")
+        name, value = name.strip().lower(), value.strip()
+        if name in ALLOWED_STYLES and value and not UNSAFE_STYLE_VALUE.search(value):
+            declarations.append(f"{name}:{value}")
+    return ";".join(declarations)
+
+
+class Sanitizer(HTMLParser):
+    # Rewrites markup with allowed tags and attributes only, every open tag closed and whitespace collapsed.
+    # Images get loading="lazy", links opening a new tab get rel="noopener". `trusted` (posts) also keeps embeds.
+    def __init__(self, trusted=False):
+        super().__init__(convert_charrefs=True)
+        self.trusted = trusted
+        self.allowed_tags = ALLOWED_TAGS | TRUSTED_TAGS if trusted else ALLOWED_TAGS
+        self.dropped_tags = DROPPED_TAGS - TRUSTED_TAGS if trusted else DROPPED_TAGS
+        self.parts = []
+        self._open = []
+        self._dropping = 0
+        self._preformatted = 0
+        # Right after a block tag, where a space would only be layout
+        self._block_edge = True
+
+    def handle_starttag(self, tag, attrs):
+        if self._dropping or tag in self.dropped_tags:
+            self._dropping += tag in self.dropped_tags
+            return
+        if tag not in self.allowed_tags:
+            return
+        attributes = []
+        for name, value in attrs:
+            value = value or ""
+            if name in ("href", "src", "poster"):
+                value = safe_url(value, data_image=self.trusted and tag == "img")
+            elif name == "style":
+                value = safe_style(value)
+            elif name in TRUSTED_ATTRIBUTES.get(tag, ()) or name == "class" and self.trusted:
+                value = name if name in BOOLEAN_ATTRIBUTES else value
+            elif name not in ALLOWED_ATTRIBUTES.get(tag, ()):
+                value = None
+            if value:
+                attributes.append((name, value))
+        if tag == "img":
+            attributes += [("loading", "lazy"), ("decoding", "async")]
+        if tag == "iframe":
+            attributes.append(("loading", "lazy"))
+        if tag == "a" and ("target", "_blank") in attributes:
+            attributes.append(("rel", "noopener noreferrer"))
+        if tag in utils.BLOCK_TAGS:
+            self._trim()
+        self.parts.append(f"<{tag}" + "".join(f' {name}="{escape(value)}"' for name, value in attributes) + ">")
+        self._block_edge = tag in utils.BLOCK_TAGS
+        if tag not in VOID_TAGS:
+            self._open.append(tag)
+            self._preformatted += tag == "pre"
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_TAGS and self._open and self._open[-1] == tag:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.dropped_tags and self._dropping:
+            self._dropping -= 1
+            return
+        if self._dropping or tag not in self._open:
+            return
+        # Closes whatever was left open inside it
+        while self._open:
+            open_tag = self._open.pop()
+            if open_tag in utils.BLOCK_TAGS:
+                self._trim()
+            self._preformatted -= open_tag == "pre"
+            self.parts.append(f"</{open_tag}>")
+            self._block_edge = open_tag in utils.BLOCK_TAGS
+            if open_tag == tag:
+                break
+
+    def handle_data(self, data):
+        if self._dropping:
+            return
+        if not self._preformatted:
+            data = re.sub(r"[ \t\n\r\f\v]+", " ", data)
+            if self._block_edge or self.parts and self.parts[-1].endswith(" "):
+                data = data.lstrip(" ")
+        if data:
+            self.parts.append(escape(data, quote=False))
+            self._block_edge = False
+
+    def _trim(self):
+        if self.parts and not self._preformatted and self.parts[-1].endswith(" ") \
+                and not self.parts[-1].startswith("<"):
+            self.parts[-1] = self.parts[-1].rstrip(" ")
+
+    def close(self):
+        super().close()
+        while self._open:
+            self.handle_endtag(self._open[-1])
+
+
+def sanitize(markup, trusted=False):
+    sanitizer = Sanitizer(trusted)
+    sanitizer.feed(markup or "")
+    sanitizer.close()
+    return "".join(sanitizer.parts).strip()
+
+
+def make_excerpt(text, length=EXCERPT_CHARS):
+    if len(text) <= length:
+        return text
+    cut = text.rfind(" ", 0, length)
+    return text[:cut if cut > 0 else length].rstrip(" ,;:.") + "…"
+
+
+def render(markup, trusted=False):
+    html = sanitize(markup, trusted)
+    text = utils.strip_html(html)
+    word_count = len(text.split())
+    return RenderedContent(html=html, text=text, excerpt=make_excerpt(text), word_count=word_count,
+                           reading_minutes=max(1, math.ceil(word_count / WORDS_PER_MINUTE)))
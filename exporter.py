@@ -0,0 +1,104 @@
+import hashlib
+import json
+import os
+import posixpath
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+MANIFEST_NAME = "manifest.json"
+LINK = re.compile(r'(\b(?:href|src|action)=")(/[^"]*)(")')
+BATCH_SIZE = 50
+
+# Set in each export process by _start_worker
+_client = None
+_files = None
+_base_url = None
+
+
+def page_file(url):
+    # "/" -> index.html, "/post/5" -> post/5.html
+    path = url.strip("/")
+    return f"{path}.html" if path else "index.html"
+
+
+def rewrite_links(html, file_name, files, base_url):
+    # Links to exported pages become relative to the page's file, the others go to base_url when one is given
+    directory = posixpath.dirname(file_name)
+
+    def rewrite(match):
+        url = match.group(2)
+        if url.startswith("//"):
+            return match.group()
+        path, hash_mark, fragment = url.partition("#")
+        if path in files:
+            url = posixpath.relpath(files[path], directory or ".") + hash_mark + fragment
+        elif base_url and path:
+            url = base_url.rstrip("/") + url
+        return match.group(1) + url + match.group(3)
+    return LINK.sub(rewrite, html)
+
+
+def write_file(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(content)
+    os.replace(temp_path, path)
+
+
+def _start_worker(setup, files, base_url):
+    global _client, _files, _base_url
+    _client = setup().test_client()
+    _files, _base_url = files, base_url
+
+
+def _render(directory, urls):
+    rendered = []
+    for url in urls:
+        response = _client.get(url)
+        if response.status_code != 200:
+            raise RuntimeError(f"{url} answered {response.status_code}")
+        content = rewrite_links(response.get_data(as_text=True), _files[url], _files, _base_url).encode("utf8")
+        write_file(os.path.join(directory, _files[url]), content)
+        rendered.append((url, hashlib.sha256(content).hexdigest()))
+    return rendered
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME), encoding="utf8") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {"pages": {}}
+
+
+def export(directory, versions, setup, jobs=None, full=False, base_url=""):
+    # `versions` maps every page URL to a string that changes whenever the page would, only pages whose version
+    # differs from the manifest's are rendered again. `setup` runs in each worker process and returns the app;
+    # it has to be importable (a module level function) for the process pool.
+    # Returns the number of pages rendered and removed.
+    previous = load_manifest(directory)
+    old_pages = previous["pages"] if not full and previous.get("base_url", "") == base_url else {}
+    files = {url: page_file(url) for url in versions}
+    stale = [url for url, version in versions.items()
+             if old_pages.get(url, {}).get("version") != version
+             or not os.path.isfile(os.path.join(directory, files[url]))]
+    pages = {url: old_pages[url] for url in versions if url not in stale}
+    if stale:
+        batches = [stale[start:start + BATCH_SIZE] for start in range(0, len(stale), BATCH_SIZE)]
+        with ProcessPoolExecutor(max_workers=max(1, min(jobs or os.cpu_count(), len(batches))),
+                                 initializer=_start_worker, initargs=(setup, files, base_url)) as executor:
+            for rendered in executor.map(_render, [directory] * len(batches), batches):
+                for url, digest in rendered:
+                    pages[url] = {"file": files[url], "version": versions[url], "sha256": digest}
+    removed = [url for url in previous["pages"] if url not in versions]
+    for url in removed:
+        try:
+            os.remove(os.path.join(directory, previous["pages"][url]["file"]))
+        except OSError:
+            pass
+    manifest = {"generated_at": datetime.utcnow().isoformat(timespec="seconds"), "base_url": base_url,
+                "pages": dict(sorted(pages.items()))}
+    write_file(os.path.join(directory, MANIFEST_NAME), json.dumps(manifest, indent=1).encode("utf8"))
+    return len(stale), len(removed)
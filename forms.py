@@ -33,6 +33,7 @@ class CreateCategoryForm(FlaskForm):
     name = StringField("Category Name", validators=[DataRequired()])
     description = StringField("Description", validators=[DataRequired()])
     img_url = StringField("Image URL", validators=[DataRequired(), URL()])
+    ordering = SelectField("Post order", choices=[("id", "Publication order"), ("natural", "Section number")])
     submit = SubmitField("Submit Category")
 
 
@@ -0,0 +1,31 @@
+# Cooperative I/O under gevent: gunicorn's gevent worker (see gunicorn.conf.py) and `python main.py`
+# monkey patch the standard library, psycopg2 talks to its socket in C and needs a wait callback instead.
+
+
+def patch_all():
+    from gevent import monkey
+    monkey.patch_all()
+    patch_psycopg()
+
+
+def patch_psycopg():
+    # Same callback as psycogreen: libpq runs non-blocking and the greenlet waits on the socket,
+    # so a slow query only suspends its own request instead of the whole worker
+    try:
+        from psycopg2 import extensions, OperationalError
+    except ImportError:
+        return
+    from gevent.socket import wait_read, wait_write
+
+    def gevent_wait_callback(connection, timeout=None):
+        while True:
+            state = connection.poll()
+            if state == extensions.POLL_OK:
+                break
+            if state == extensions.POLL_READ:
+                wait_read(connection.fileno(), timeout=timeout)
+            elif state == extensions.POLL_WRITE:
+                wait_write(connection.fileno(), timeout=timeout)
+            else:
+                raise OperationalError(f"Bad result from poll: {state!r}")
+    extensions.set_wait_callback(gevent_wait_callback)
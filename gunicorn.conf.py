@@ -0,0 +1,23 @@
+# gunicorn picks this file up from the working directory: `gunicorn main:app`
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8000)}"
+# "gevent" serves many concurrent requests per worker while they wait on postgres, SMTP or image origins,
+# GUNICORN_WORKER_CLASS=sync falls back to one request per worker process
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+# Heroku sets WEB_CONCURRENCY from the dyno size
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+# Concurrent requests per gevent worker, keep DB_POOL_SIZE + DB_MAX_OVERFLOW in proportion
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", 100))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 30))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 5))
+# The gevent worker monkey patches when it starts, the app must be imported afterwards
+preload_app = False
+accesslog = os.environ.get("GUNICORN_ACCESS_LOG")
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        import green
+        green.patch_psycopg()
@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask_login import UserMixin
+
+
+class CachedUser(UserMixin):
+    # What requests need of the logged in user, detached from any session so it can be shared between requests.
+    # Views set author_id=current_user.id, there is no relationship to load through it.
+    def __init__(self, id, email, name, session_version):
+        self.id = id
+        self.email = email
+        self.name = name
+        self.session_version = session_version
+
+    def get_id(self):
+        return session_id(self.id, self.session_version)
+
+
+def session_id(user_id, session_version):
+    # Stored in the session cookie by flask-login: a session made before the version was bumped no longer loads
+    return f"{user_id}:{session_version}"
+
+
+def parse_session_id(value):
+    # Sessions from before the version existed only hold the id, they match version 0
+    user_id, _, session_version = str(value).partition(":")
+    return int(user_id), int(session_version or 0)
+
+
+class IdentityCache:
+    # Per worker LRU of CachedUser under (user id, session version), entries expire after `ttl` seconds.
+    # The version comes from the session cookie, so the session that changed a user reads the new row in every
+    # worker; other workers' entries for the old version only live until they expire.
+    def __init__(self, max_size=1024, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, user = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return user
+
+    def set(self, key, user):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def discard(self, user_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == user_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
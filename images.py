@@ -0,0 +1,223 @@
+import hashlib
+import hmac
+import http.client
+import io
+import ipaddress
+import os
+import socket
+import threading
+from urllib.request import (HTTPDefaultErrorHandler, HTTPErrorProcessor, HTTPHandler, HTTPRedirectHandler,
+                            HTTPSHandler, OpenerDirector, Request, UnknownHandler)
+
+from flask import abort, current_app, redirect, request, send_file, url_for
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Thumbnails are only made at these widths, a requested width is rounded up to the next one
+WIDTHS = (160, 320, 640, 960, 1280)
+MAX_AGE = 31536000
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg"), "png": ("PNG", "image/png")}
+
+
+def is_public(ip):
+    ip = ipaddress.ip_address(ip.split("%")[0])
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def public_connection(address, *args, **kwargs):
+    # Every connection the fetch makes, redirects included, goes to public addresses only. The address actually
+    # connected to is checked again, in case the name resolved differently the second time.
+    host, port = address[:2]
+    if not all(is_public(info[4][0]) for info in socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)):
+        raise OSError(f"{host} is not a public address")
+    connection = socket.create_connection(address, *args, **kwargs)
+    if not is_public(connection.getpeername()[0]):
+        connection.close()
+        raise OSError(f"{host} is not a public address")
+    return connection
+
+
+class PublicHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = public_connection
+
+
+class PublicHTTPSConnection(http.client.HTTPSConnection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._create_connection = public_connection
+
+
+class PublicHTTPHandler(HTTPHandler):
+    def http_open(self, req):
+        return self.do_open(PublicHTTPConnection, req)
+
+
+class PublicHTTPSHandler(HTTPSHandler):
+    def https_open(self, req):
+        return self.do_open(PublicHTTPSConnection, req, context=self._context)
+
+
+def public_opener():
+    # http and https only, no proxy from the environment: redirects to other schemes fail
+    opener = OpenerDirector()
+    for handler in (PublicHTTPHandler(), PublicHTTPSHandler(), HTTPRedirectHandler(), HTTPDefaultErrorHandler(),
+                    HTTPErrorProcessor(), UnknownHandler()):
+        opener.add_handler(handler)
+    return opener
+
+
+class ImageCache:
+    # Source images and their thumbnails on disk, under the hash of the source URL.
+    # Hits touch the file's mtime, eviction removes the least recently used files once the total passes max_bytes.
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, name):
+        return os.path.join(self.directory, key[:2], key, name)
+
+    def get(self, key, name):
+        path = self.path(key, name)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+
+    def set(self, key, name, content):
+        path = self.path(key, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as file:
+            file.write(content)
+        os.replace(temp_path, path)
+        self._written += len(content)
+        # Only walk the directory once in a while
+        if self._written > self.max_bytes // 10:
+            self._written = 0
+            self.evict()
+        return path
+
+    def evict(self):
+        entries = []
+        for directory, _, files in os.walk(self.directory):
+            for file_name in files:
+                path = os.path.join(directory, file_name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class ImageProxy:
+    # /img/<key>?src=<url>&w=<width> serves a resized copy of a remote image, fetched once and cached on disk.
+    # The key is an HMAC of the source URL, so only URLs our own pages link to can be fetched through it, and only
+    # from public addresses.
+    # Templates call thumbnail(url, width), which leaves the URL untouched when Pillow isn't installed.
+    def __init__(self, app=None):
+        self.cache = None
+        self.config = None
+        self._locks = [threading.Lock() for _ in range(32)]
+        self._opener = public_opener()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.config = app.config
+        self.cache = ImageCache(app.config['IMAGE_CACHE_DIR'], app.config['IMAGE_CACHE_MAX_BYTES'])
+        app.add_url_rule("/img/<key>", "image", self.serve)
+        app.jinja_env.globals.update(thumbnail=self.url)
+
+    @property
+    def enabled(self):
+        return Image is not None and self.config['IMAGE_PROXY']
+
+    def sign(self, source):
+        secret = (self.config['SECRET_KEY'] or "").encode("utf8")
+        return hmac.new(secret, source.encode("utf8"), hashlib.sha256).hexdigest()[:32]
+
+    def url(self, source, width):
+        if not source or not self.enabled or source.split("://")[0] not in self.config['IMAGE_SOURCE_SCHEMES']:
+            return source
+        return url_for("image", key=self.sign(source), src=source, w=width)
+
+    def serve(self, key):
+        source = request.args.get("src", "")
+        if not self.enabled or not hmac.compare_digest(key, self.sign(source)):
+            return abort(404)
+        width = next((width for width in WIDTHS if width >= request.args.get("w", 0, type=int)), WIDTHS[-1])
+        # Listed explicitly, "*/*" doesn't mean the browser decodes webp
+        image_format = "webp" if "image/webp" in request.accept_mimetypes.values() else None
+        for _ in range(2):
+            try:
+                path, image_format = self.thumbnail(key, source, width, image_format)
+            except (OSError, ValueError, Image.DecompressionBombError) as error:
+                current_app.logger.warning("No thumbnail for %s: %s", source, error)
+                # Let the browser try the origin itself
+                return redirect(source)
+            try:
+                response = send_file(path, mimetype=FORMATS[image_format][1], max_age=MAX_AGE)
+                break
+            except FileNotFoundError:
+                # Evicted by another request since thumbnail() found it, made again on the next pass
+                continue
+        else:
+            return abort(404)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.vary.add("Accept")
+        return response
+
+    def thumbnail(self, key, source, width, image_format):
+        # Without webp support in the browser: jpeg, or png for images with transparency
+        names = [f"{width}.{image_format}"] if image_format else [f"{width}.jpeg", f"{width}.png"]
+        for name in names:
+            path = self.cache.get(key, name)
+            if path is not None:
+                return path, name.split(".")[1]
+        with self._locks[int(key[:2], 16) % len(self._locks)]:
+            source_path = self.cache.get(key, "source")
+            if source_path is None:
+                content = self.fetch(source)
+                # Only images are kept, anything else fails here before reaching the disk
+                Image.open(io.BytesIO(content)).close()
+                source_path = self.cache.set(key, "source", content)
+            with Image.open(source_path) as image:
+                image = ImageOps.exif_transpose(image)
+                if image.width > width:
+                    image.thumbnail((width, image.height * width // image.width), Image.LANCZOS)
+                transparent = image.mode in ("RGBA", "LA") or "transparency" in image.info
+                image_format = image_format or ("png" if transparent else "jpeg")
+                if image.mode not in ("RGB", "RGBA") or image_format == "jpeg":
+                    image = image.convert("RGBA" if transparent and image_format != "jpeg" else "RGB")
+                output = io.BytesIO()
+                image.save(output, FORMATS[image_format][0], quality=self.config['IMAGE_QUALITY'], optimize=True)
+            return self.cache.set(key, f"{width}.{image_format}", output.getvalue()), image_format
+
+    def fetch(self, source):
+        limit = self.config['IMAGE_MAX_SOURCE_BYTES']
+        with self._opener.open(Request(source, headers={"User-Agent": "portfolio-image-proxy"}),
+                               timeout=self.config['IMAGE_FETCH_TIMEOUT']) as response:
+            content = response.read(limit + 1)
+        if len(content) > limit:
+            raise ValueError(f"{source} is larger than {limit} bytes")
+        return content
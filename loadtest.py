@@ -0,0 +1,119 @@
+"""Concurrent load against a running site, or against gunicorn's sync and gevent workers in turn.
+
+    python loadtest.py http://127.0.0.1:8000 --clients 50 --duration 20 --path / --path /post/1
+    python loadtest.py --compare --clients 100 --workers 2
+
+--compare starts `gunicorn main:app` itself on --port with each worker class (the environment is passed
+through, point DATABASE_ at the database to test) and prints one line per setup.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def run_load(base_url, paths, clients, duration):
+    # Every client loops over the paths on its own keep-alive session until the time is up
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(offset):
+        session = requests.Session()
+        own_latencies, own_errors, position = [], 0, offset
+        while time.monotonic() < deadline:
+            started = time.perf_counter()
+            try:
+                response = session.get(base_url + paths[position % len(paths)], timeout=30)
+                failed = response.status_code >= 500
+            except requests.RequestException:
+                failed = True
+            own_latencies.append(time.perf_counter() - started)
+            own_errors += failed
+            position += 1
+        with lock:
+            latencies.extend(own_latencies)
+            errors[0] += own_errors
+
+    threads = [threading.Thread(target=client, args=(number,)) for number in range(clients)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+    latencies.sort()
+    return {"requests": len(latencies), "errors": errors[0], "rps": len(latencies) / elapsed,
+            "p50": percentile(latencies, 0.50), "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99)}
+
+
+def format_result(label, result):
+    return (f"{label:<10} {result['requests']:>8} req {result['rps']:>9.1f} req/s  "
+            f"p50 {result['p50'] * 1000:>7.1f} ms  p95 {result['p95'] * 1000:>7.1f} ms  "
+            f"p99 {result['p99'] * 1000:>7.1f} ms  {result['errors']} errors")
+
+
+def wait_until_up(base_url, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(base_url + "/", timeout=2)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{base_url} didn't come up in {timeout}s")
+
+
+def start_gunicorn(worker_class, workers, port):
+    environment = dict(os.environ, GUNICORN_WORKER_CLASS=worker_class, WEB_CONCURRENCY=str(workers),
+                       PORT=str(port))
+    return subprocess.Popen([sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "main:app"],
+                            env=environment, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("url", nargs="?", default=None, help="Base URL of a running site.")
+    parser.add_argument("--path", action="append", help="Path to request, repeat for several (default /).")
+    parser.add_argument("--clients", type=int, default=50, help="Concurrent clients.")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds of load per run.")
+    parser.add_argument("--compare", action="store_true", help="Run gunicorn with sync, then gevent workers.")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn workers for --compare.")
+    parser.add_argument("--port", type=int, default=8765, help="Port for --compare.")
+    arguments = parser.parse_args()
+    paths = arguments.path or ["/"]
+
+    if not arguments.compare:
+        if not arguments.url:
+            parser.error("a URL is required without --compare")
+        wait_until_up(arguments.url)
+        print(format_result("site", run_load(arguments.url, paths, arguments.clients, arguments.duration)))
+        return
+
+    base_url = f"http://127.0.0.1:{arguments.port}"
+    print(f"{arguments.clients} clients, {arguments.workers} workers, {arguments.duration:g}s per run, paths {paths}")
+    for worker_class in ("sync", "gevent"):
+        server = start_gunicorn(worker_class, arguments.workers, arguments.port)
+        try:
+            wait_until_up(base_url)
+            # Warm caches and connection pools before measuring
+            run_load(base_url, paths, arguments.clients, min(arguments.duration / 4, 3))
+            print(format_result(worker_class, run_load(base_url, paths, arguments.clients, arguments.duration)))
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
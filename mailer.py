@@ -0,0 +1,130 @@
+import smtplib
+import threading
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+
+class MailSender:
+    # Background sender for the mail outbox: requests only add rows, this thread delivers them
+    # over a single authenticated SMTP connection, retrying failed mails with exponential backoff.
+    # Comment notifications are coalesced into one digest every `digest_seconds`.
+    def __init__(self, app, db, model):
+        self.app = app
+        self.db = db
+        self.model = model
+        self._smtp = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+
+    @property
+    def config(self):
+        return self.app.config
+
+    def ensure_started(self):
+        if self._thread is not None or self.config['MAIL_SENDER'] != "thread":
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run_forever, name="mail-sender", daemon=True)
+                self._thread.start()
+
+    def wake(self):
+        self._wake.set()
+
+    def run_forever(self):
+        while True:
+            with self.app.app_context():
+                try:
+                    self.run_once()
+                except Exception:
+                    self.app.logger.exception("Mail outbox run failed")
+                    self.db.session.rollback()
+                finally:
+                    self.db.session.remove()
+            self._wake.wait(self.config['MAIL_POLL_SECONDS'])
+            self._wake.clear()
+
+    def run_once(self, now=None):
+        now = now or datetime.utcnow()
+        # Rows locked by another worker's sender are skipped (postgres only, sqlite serializes writes anyway)
+        pending = self.model.query.filter(self.model.sent_at.is_(None),
+                                          self.model.next_attempt_at <= now,
+                                          self.model.attempts < self.config['MAIL_MAX_ATTEMPTS'])\
+            .order_by(self.model.id).with_for_update(skip_locked=True).all()
+        comments = [mail for mail in pending if mail.kind == "comment"]
+        batches = [[mail] for mail in pending if mail.kind != "comment"]
+        digest_due = now - timedelta(seconds=self.config['MAIL_DIGEST_SECONDS'])
+        if comments and min(mail.created_at for mail in comments) <= digest_due:
+            batches.append(comments)
+        for batch in batches:
+            self._deliver(batch, now)
+        self.db.session.commit()
+        if not pending:
+            self.close()
+
+    def dead_count(self):
+        # Mails run_once no longer picks up, they stay in the outbox for a look at last_error
+        return self.model.query.filter(self.model.sent_at.is_(None),
+                                       self.model.attempts >= self.config['MAIL_MAX_ATTEMPTS']).count()
+
+    def _deliver(self, batch, now):
+        try:
+            self._send(self._build_message(batch))
+        except (smtplib.SMTPException, OSError) as error:
+            self.close()
+            for mail in batch:
+                mail.attempts += 1
+                mail.last_error = str(error)[:250]
+                delay = min(self.config['MAIL_RETRY_SECONDS'] * 2 ** (mail.attempts - 1), 3600)
+                mail.next_attempt_at = now + timedelta(seconds=delay)
+                if mail.attempts >= self.config['MAIL_MAX_ATTEMPTS']:
+                    self.app.logger.error("Giving up on mail %d (%s) after %d attempts: %s", mail.id, mail.subject,
+                                          mail.attempts, error)
+            self.app.logger.warning("Could not send %d mail(s): %s", len(batch), error)
+        else:
+            for mail in batch:
+                mail.sent_at = now
+
+    def _build_message(self, batch):
+        message = EmailMessage()
+        admin = self.config['ADMIN_MAIL']
+        message["From"] = admin
+        message["To"] = admin
+        if len(batch) == 1:
+            message["Subject"] = batch[0].subject
+            message.set_content(batch[0].body)
+        else:
+            message["Subject"] = f"from Blog: {len(batch)} new comments"
+            message.set_content("\n\n".join(mail.body for mail in batch))
+        reply_to = {mail.reply_to for mail in batch if mail.reply_to}
+        if len(reply_to) == 1:
+            message["Reply-To"] = reply_to.pop()
+        return message
+
+    def _send(self, message):
+        if self._smtp is None:
+            self._smtp = self._connect()
+        else:
+            try:
+                self._smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                self.close()
+                self._smtp = self._connect()
+        self._smtp.send_message(message)
+
+    def _connect(self):
+        connexion = smtplib.SMTP(self.config['MAIL_SERVER'], self.config['MAIL_PORT'], timeout=30)
+        if self.config['MAIL_USE_TLS']:
+            connexion.starttls()
+        if self.config['MAIL_PASS']:
+            connexion.login(user=self.config['ADMIN_MAIL'], password=self.config['MAIL_PASS'])
+        return connexion
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
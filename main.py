@@ -1,22 +1,53 @@
+if __name__ == "__main__":
+    # Standalone gevent server: the standard library must be patched before anything imports it
+    import green
+    green.patch_all()
+
+import cProfile
+import io
+import math
 import os
-from datetime import date, datetime
-from functools import wraps
+import pstats
 import random
-import smtplib
+import tempfile
+import time
+from datetime import date, datetime, timezone
+from functools import wraps
 
-import utils
+import click
 
-from flask import Flask, render_template, redirect, url_for, flash, request
-from flask import abort
+import assets as static_assets
+import content
+import exporter
+import utils
+from identity import CachedUser, IdentityCache, parse_session_id, session_id
+from compression import Compression
+from images import ImageProxy
+from mailer import MailSender
+from metrics import Metrics, QUERY_COUNT_BUCKETS
+from page_cache import PageCache, MemoryBackend, FileBackend
+from passwords import PasswordHasher
+from search import PostIndex, SearchHit, HIGHLIGHT_START, HIGHLIGHT_STOP, highlight
+from throttle import LoginThrottle, MemoryBuckets, SqliteBuckets
+
+from flask import Flask, render_template, redirect, url_for, flash, request, jsonify
+from flask import abort, g, session, has_request_context, before_render_template, template_rendered, stream_template
+from flask_wtf.csrf import generate_csrf, validate_csrf
+from wtforms import ValidationError
+from markupsafe import Markup, escape
 from flask_bootstrap import Bootstrap
 from flask_ckeditor import CKEditor
 from flask_gravatar import Gravatar
 from flask_login import login_user, LoginManager, current_user, logout_user
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import UserMixin
-from sqlalchemy.orm import relationship
+from sqlalchemy import DDL, event, and_, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import relationship, joinedload, selectinload, defer
 from gevent.pywsgi import WSGIServer
 
 from forms import RegisterForm, LoginForm, CreatePostForm, CreateCategoryForm, CreateMaximeForm, CommentForm, \
@@ -27,10 +58,22 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get("SECRET_KEY")
 ckeditor = CKEditor(app)
 Bootstrap(app)
+# Fingerprinted, precompressed static files built by `flask build-assets`
+assets = static_assets.Assets(app)
 
 # #CONNECT TO DB
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get("DATABASE_")
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+if not (app.config['SQLALCHEMY_DATABASE_URI'] or "sqlite").startswith("sqlite"):
+    # QueuePool: under gevent, requests beyond size + overflow wait up to DB_POOL_TIMEOUT for a connection.
+    # Pre-ping and recycle drop connections the server or a proxy closed while they sat in the pool.
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        "pool_size": int(os.environ.get("DB_POOL_SIZE", 10)),
+        "max_overflow": int(os.environ.get("DB_MAX_OVERFLOW", 20)),
+        "pool_timeout": float(os.environ.get("DB_POOL_TIMEOUT", 10)),
+        "pool_recycle": int(os.environ.get("DB_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": os.environ.get("DB_POOL_PRE_PING", "on") == "on",
+    }
 db = SQLAlchemy()
 db.init_app(app)
 migrate = Migrate(app, db, compare_type=True)
@@ -41,6 +84,80 @@ login_manager.init_app(app)
 app.config['RECAPTCHA_USE_SSL'] = False
 app.config['RECAPTCHA_PUBLIC_KEY'] = os.environ.get("CAPTCHA_PRIVATE")
 app.config['RECAPTCHA_PRIVATE_KEY'] = os.environ.get("CAPTCHA_PUBLIC")
+# Maximes are cached in memory, reloaded after this many seconds (other workers can't invalidate our pool)
+app.config['MAXIME_CACHE_TTL'] = int(os.environ.get("MAXIME_CACHE_TTL", 300))
+# Debug aid: flag requests running more queries than this (0 disables the check)
+app.config['QUERY_BUDGET'] = int(os.environ.get("QUERY_BUDGET", 0))
+# Instrumentation: queries slower than this are logged, /metrics also accepts "Authorization: Bearer <token>"
+app.config['SLOW_QUERY_MS'] = float(os.environ.get("SLOW_QUERY_MS", 200))
+app.config['METRICS_TOKEN'] = os.environ.get("METRICS_TOKEN")
+# Fraction of requests run under cProfile, their top functions are logged
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get("PROFILE_SAMPLE_RATE", 0))
+app.config['PROFILE_TOP_FUNCTIONS'] = int(os.environ.get("PROFILE_TOP_FUNCTIONS", 25))
+
+# Mail: requests only queue mails in the outbox, MailSender delivers them in the background
+app.config['ADMIN_MAIL'] = os.environ.get("ADMIN_MAIL")
+app.config['MAIL_PASS'] = os.environ.get("MAIL_PASS")
+app.config['MAIL_SERVER'] = os.environ.get("MAIL_SERVER", "smtp.gmail.com")
+app.config['MAIL_PORT'] = int(os.environ.get("MAIL_PORT", 587))
+app.config['MAIL_USE_TLS'] = os.environ.get("MAIL_USE_TLS", "1") == "1"
+# "thread" runs the sender inside each web worker, "off" leaves it to `flask send-mail`
+app.config['MAIL_SENDER'] = os.environ.get("MAIL_SENDER", "thread")
+app.config['MAIL_POLL_SECONDS'] = int(os.environ.get("MAIL_POLL_SECONDS", 5))
+app.config['MAIL_DIGEST_SECONDS'] = int(os.environ.get("MAIL_DIGEST_SECONDS", 60))
+app.config['MAIL_RETRY_SECONDS'] = int(os.environ.get("MAIL_RETRY_SECONDS", 30))
+app.config['MAIL_MAX_ATTEMPTS'] = int(os.environ.get("MAIL_MAX_ATTEMPTS", 8))
+
+# Rendered public pages: "filesystem" (shared by the workers of a machine), "memory" or "off". "memory" is only for
+# a single worker process: an edit invalidates the pages of the worker that handled it, the others serve the old
+# ones for up to PAGE_CACHE_TTL
+app.config['PAGE_CACHE'] = os.environ.get("PAGE_CACHE", "filesystem")
+app.config['PAGE_CACHE_DIR'] = os.environ.get("PAGE_CACHE_DIR",
+                                              os.path.join(tempfile.gettempdir(), "portfolio-page-cache"))
+app.config['PAGE_CACHE_MAX_BYTES'] = int(os.environ.get("PAGE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get("PAGE_CACHE_TTL", 300))
+# HTML, CSS, JSON... responses are gzip/brotli compressed from this size, streamed pages are sent in chunks of
+# at least STREAM_CHUNK_BYTES (the header goes out first, then the posts as they are rendered)
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))
+app.config['COMPRESS_CACHE_BYTES'] = int(os.environ.get("COMPRESS_CACHE_BYTES", 8 * 1024 * 1024))
+app.config['STREAM_CHUNK_BYTES'] = int(os.environ.get("STREAM_CHUNK_BYTES", 4096))
+# Post and category img_url images (admin authored) are served as thumbnails through /img/ (needs Pillow), cached on
+# disk up to IMAGE_CACHE_MAX_BYTES. To-do project images are linked as they are.
+app.config['IMAGE_PROXY'] = os.environ.get("IMAGE_PROXY", "on") == "on"
+app.config['IMAGE_SOURCE_SCHEMES'] = os.environ.get("IMAGE_SOURCE_SCHEMES", "http,https").split(",")
+app.config['IMAGE_CACHE_DIR'] = os.environ.get("IMAGE_CACHE_DIR",
+                                              os.path.join(tempfile.gettempdir(), "portfolio-images"))
+app.config['IMAGE_CACHE_MAX_BYTES'] = int(os.environ.get("IMAGE_CACHE_MAX_BYTES", 512 * 1024 * 1024))
+app.config['IMAGE_MAX_SOURCE_BYTES'] = int(os.environ.get("IMAGE_MAX_SOURCE_BYTES", 20 * 1024 * 1024))
+app.config['IMAGE_FETCH_TIMEOUT'] = float(os.environ.get("IMAGE_FETCH_TIMEOUT", 10))
+app.config['IMAGE_QUALITY'] = int(os.environ.get("IMAGE_QUALITY", 80))
+# Password checks per client IP and per account: bursts of *_BURST, then *_PER_MINUTE. LOGIN_THROTTLE is "memory"
+# (per worker), "sqlite" (shared by the workers through LOGIN_THROTTLE_PATH) or "off"
+app.config['LOGIN_THROTTLE'] = os.environ.get("LOGIN_THROTTLE", "memory")
+app.config['LOGIN_THROTTLE_PATH'] = os.environ.get("LOGIN_THROTTLE_PATH",
+                                                   os.path.join(tempfile.gettempdir(), "portfolio-login-throttle.db"))
+app.config['LOGIN_IP_BURST'] = int(os.environ.get("LOGIN_IP_BURST", 20))
+app.config['LOGIN_IP_PER_MINUTE'] = float(os.environ.get("LOGIN_IP_PER_MINUTE", 10))
+app.config['LOGIN_EMAIL_BURST'] = int(os.environ.get("LOGIN_EMAIL_BURST", 5))
+app.config['LOGIN_EMAIL_PER_MINUTE'] = float(os.environ.get("LOGIN_EMAIL_PER_MINUTE", 2))
+# Client IPs come from X-Forwarded-For when behind this many proxies. Heroku (DYNO is set) runs behind its router,
+# without it the per IP login bucket would be shared by every client.
+app.config['TRUSTED_PROXIES'] = int(os.environ.get("TRUSTED_PROXIES", 1 if os.environ.get("DYNO") else 0))
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'])
+# Stored hashes made with other parameters are replaced at the next login
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get("PASSWORD_HASH_METHOD", "pbkdf2:sha256:260000")
+app.config['PASSWORD_SALT_LENGTH'] = int(os.environ.get("PASSWORD_SALT_LENGTH", 16))
+app.config['PASSWORD_HASH_THREADS'] = int(os.environ.get("PASSWORD_HASH_THREADS", 2))
+# Logged in users are loaded from a per worker cache, a password change logs the user's other sessions out
+app.config['IDENTITY_CACHE_SIZE'] = int(os.environ.get("IDENTITY_CACHE_SIZE", 1024))
+app.config['IDENTITY_CACHE_TTL'] = int(os.environ.get("IDENTITY_CACHE_TTL", 30))
+# To-do quotas, per user and per project
+app.config['TODO_MAX_PROJECTS'] = int(os.environ.get("TODO_MAX_PROJECTS", 10))
+app.config['TODO_MAX_TASKS'] = int(os.environ.get("TODO_MAX_TASKS", 100))
+# Listings are keyset paginated with ?after=<last id>
+app.config['POSTS_PER_PAGE'] = int(os.environ.get("POSTS_PER_PAGE", 10))
+app.config['COMMENTS_PER_PAGE'] = int(os.environ.get("COMMENTS_PER_PAGE", 20))
 
 gravatar = Gravatar(app, size=40, rating='x', default='retro', force_default=False, force_lower=False, use_ssl=False,
                     base_url=None)
@@ -49,10 +166,12 @@ gravatar = Gravatar(app, size=40, rating='x', default='retro', force_default=Fal
 class User(UserMixin, db.Model):
     __tablename__ = "users"
     id = db.Column(db.Integer, primary_key=True)
-    email = db.Column(db.String(50), nullable=False)
+    email = db.Column(db.String(50), nullable=False, index=True)
     password = db.Column(db.String(100), nullable=False)
     name = db.Column(db.String(100), nullable=False)
     bio = db.Column(db.Text, nullable=True)
+    # Part of the session cookie, bumped by bump_session_version() to log every session out
+    session_version = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     # This will act like a List of BlogPost objects attached to each User.
     # The "author" refers to the author property in the BlogPost class.
@@ -61,10 +180,14 @@ class User(UserMixin, db.Model):
     projects = relationship("ToDoProject", back_populates="author")
     todo_items = relationship("ToDo", back_populates="author")
 
+    def get_id(self):
+        return session_id(self.id, self.session_version or 0)
+
 
 tag_link = db.Table("tag_link", db.Model.metadata,
-                    db.Column("post_id", db.Integer, db.ForeignKey("blog_posts.id")),
-                    db.Column("tag_id", db.Integer, db.ForeignKey("tags.id"))
+                    db.Column("post_id", db.Integer, db.ForeignKey("blog_posts.id"), primary_key=True),
+                    db.Column("tag_id", db.Integer, db.ForeignKey("tags.id"), primary_key=True),
+                    db.Index("ix_tag_link_tag_id", "tag_id", "post_id")
                     )
 
 
@@ -83,15 +206,18 @@ class ToDo(db.Model):
     body = db.Column(db.Text, nullable=True)
     priority = db.Column(db.Integer, nullable=False)
     status = db.Column(db.Integer, nullable=False)
-    project_id = db.Column(db.Integer, db.ForeignKey("todo_projects.id"))
+    project_id = db.Column(db.Integer, db.ForeignKey("todo_projects.id"), index=True)
     project = relationship("ToDoProject", back_populates="parent_todo_list")
 
+    # show_todo lists open and closed tasks by priority, highest first: the index reads in that order
+    __table_args__ = (db.Index("ix_todo_list_project_id_status", project_id, status, priority.desc(), id),)
+
 
 class ToDoProject(db.Model):
     __tablename__ = "todo_projects"
     id = db.Column(db.Integer, primary_key=True)
     # Create Foreign Key, "users.id" the users refers to the table name of User.
-    author_id = db.Column(db.Integer, db.ForeignKey("users.id"))
+    author_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
     # Create reference to the User object, the "posts" refers to the posts property in the User class.
     author = relationship("User", back_populates="projects")
     name = db.Column(db.String(250), nullable=False)
@@ -110,9 +236,19 @@ class BlogPost(db.Model):
     author = relationship("User", back_populates="posts")
 
     title = db.Column(db.String(250), unique=True, nullable=False)
+    # Title with zero-padded numbers, see utils.natural_sort_key
+    sort_key = db.Column(db.String(500), nullable=False)
     subtitle = db.Column(db.String(250), nullable=False)
-    date = db.Column(db.String(250), nullable=False)
+    date = db.Column(db.Date, nullable=False, default=date.today)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     body = db.Column(db.Text, nullable=False)
+    # Computed from body on save by render_post_body(), pages only show these.
+    # body_text is also what search indexes (postgres derives the search_vector column from it)
+    body_html = db.Column(db.Text, nullable=True)
+    body_text = db.Column(db.Text, nullable=True)
+    excerpt = db.Column(db.Text, nullable=True)
+    word_count = db.Column(db.Integer, nullable=True)
+    reading_minutes = db.Column(db.Integer, nullable=True)
     img_url = db.Column(db.String(250), nullable=True)
     header = db.Column(db.Boolean, nullable=True)
     category_id = db.Column(db.Integer, db.ForeignKey("blog_categories.id"))
@@ -120,6 +256,23 @@ class BlogPost(db.Model):
     tags = db.relationship("Tag", secondary=tag_link, backref=db.backref('entries', lazy='dynamic'))
     comments = relationship("Comment", back_populates="parent_post")
 
+    __table_args__ = (db.Index("ix_blog_posts_header", "header", "id"),
+                      db.Index("ix_blog_posts_category_id", "category_id", "id"),
+                      db.Index("ix_blog_posts_category_id_sort_key", "category_id", "sort_key"))
+
+
+# Not mapped: generated by postgres and only used by search_posts_postgresql
+SEARCH_VECTOR_DDL = (
+    """ALTER TABLE blog_posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(subtitle, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(body_text, '')), 'D')
+    ) STORED""",
+    "CREATE INDEX ix_blog_posts_search_vector ON blog_posts USING gin (search_vector)",
+)
+for statement in SEARCH_VECTOR_DDL:
+    event.listen(BlogPost.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
 
 class BlogCategory(db.Model):
     __tablename__ = "blog_categories"
@@ -127,13 +280,35 @@ class BlogCategory(db.Model):
     name = db.Column(db.String(250), nullable=False)
     description = db.Column(db.String(250), nullable=False)
     img_url = db.Column(db.String(250), nullable=True)
+    # How posts are listed on the category page, one of CATEGORY_ORDERINGS
+    ordering = db.Column(db.String(20), nullable=False, default="id", server_default="id")
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
     parent_posts = db.relationship("BlogPost", back_populates="category")
 
 
 class Tag(db.Model):
     __tablename__ = "tags"
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(250), nullable=False)
+    name = db.Column(db.String(250), nullable=False, unique=True, index=True)
+
+
+class TagStat(db.Model):
+    # Materialised per tag numbers, kept up to date by update_tag_stats so tag pages never scan tag_link
+    __tablename__ = "tag_stats"
+    tag_id = db.Column(db.Integer, db.ForeignKey("tags.id"), primary_key=True)
+    tag = relationship("Tag")
+    post_count = db.Column(db.Integer, nullable=False, default=0)
+    # Last time a post was given the tag
+    last_used_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+
+class TagPair(db.Model):
+    # Number of posts carrying both tags, stored in both directions
+    __tablename__ = "tag_pairs"
+    tag_id = db.Column(db.Integer, db.ForeignKey("tags.id"), primary_key=True)
+    related_tag_id = db.Column(db.Integer, db.ForeignKey("tags.id"), primary_key=True)
+    post_count = db.Column(db.Integer, nullable=False, default=0)
 
 
 class Comment(db.Model):
@@ -144,7 +319,12 @@ class Comment(db.Model):
     post_id = db.Column(db.Integer, db.ForeignKey("blog_posts.id"))
     parent_post = relationship("BlogPost", back_populates="comments")
     text = db.Column(db.String(250), nullable=False)
-    date = db.Column(db.String(250), nullable=False)
+    # Sanitized text, set on save
+    html = db.Column(db.Text, nullable=True)
+    date = db.Column(db.Date, nullable=False, default=date.today)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (db.Index("ix_comments_post_id", "post_id", "id"),)
 
 
 class Maxime(db.Model):
@@ -153,6 +333,253 @@ class Maxime(db.Model):
     text = db.Column(db.String(250), nullable=False)
 
 
+class OutgoingMail(db.Model):
+    __tablename__ = "mail_outbox"
+    id = db.Column(db.Integer, primary_key=True)
+    # "comment" mails are sent as a digest, anything else on its own
+    kind = db.Column(db.String(20), nullable=False)
+    subject = db.Column(db.String(250), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    reply_to = db.Column(db.String(250), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(250), nullable=True)
+    sent_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (db.Index("ix_mail_outbox_pending", "sent_at", "next_attempt_at"),)
+
+
+# Category ordering modes -> ORDER BY clauses
+CATEGORY_ORDERINGS = {
+    "id": (BlogPost.id,),
+    "natural": (BlogPost.sort_key, BlogPost.id),
+}
+
+
+def seek_page(query, order_columns, after, per_page, descending=False):
+    # Keyset pagination: the rows following the one with id `after` in `order_columns` order, the last
+    # column being the primary key. Returns the page and the cursor of the next one (None on the last page).
+    primary_key = order_columns[-1]
+    if after:
+        anchor = [db.session.query(column).filter(primary_key == after).scalar_subquery()
+                  for column in order_columns[:-1]] + [after]
+        clauses = []
+        for position, column in enumerate(order_columns):
+            follows = column < anchor[position] if descending else column > anchor[position]
+            clauses.append(and_(*[previous == value for previous, value in zip(order_columns, anchor[:position])],
+                                follows))
+        query = query.filter(or_(*clauses))
+    query = query.order_by(*[column.desc() if descending else column for column in order_columns])
+    rows = query.limit(per_page + 1).all()
+    if len(rows) > per_page:
+        return rows[:per_page], rows[per_page - 1].id
+    return rows, None
+
+
+def more_url(next_after, **values):
+    if next_after is None:
+        return None
+    return url_for(request.endpoint, after=next_after, **values)
+
+
+# Loader options shared by every page listing posts, so templates don't lazy load per row
+post_listing_options = (joinedload(BlogPost.category), selectinload(BlogPost.tags))
+# Listings show the excerpt, not the body
+post_summary_options = post_listing_options + (defer(BlogPost.body), defer(BlogPost.body_html),
+                                               defer(BlogPost.body_text))
+
+
+def render_post_body(post, markup):
+    # Posts are the admin's, their embeds are kept
+    rendered = content.render(markup, trusted=True)
+    post.body = markup
+    post.body_html, post.body_text, post.excerpt = rendered.html, rendered.text, rendered.excerpt
+    post.word_count, post.reading_minutes = rendered.word_count, rendered.reading_minutes
+
+
+def render_comment(comment):
+    comment.html = content.sanitize(comment.text)
+
+
+metrics = Metrics("portfolio")
+metrics.histogram("request_duration_seconds", "Time spent in the view, by endpoint.")
+metrics.histogram("db_duration_seconds", "Time spent running queries during a request, by endpoint.")
+metrics.histogram("db_queries", "Queries run by a request, by endpoint.", buckets=QUERY_COUNT_BUCKETS)
+metrics.histogram("template_render_seconds", "Time spent rendering templates, by template.")
+metrics.counter("requests_total", "Requests served, by endpoint and status.")
+metrics.counter("slow_queries_total", "Queries slower than SLOW_QUERY_MS.")
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    if elapsed * 1000 > app.config['SLOW_QUERY_MS']:
+        metrics.inc("slow_queries_total")
+        app.logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+        g.query_time = g.get("query_time", 0) + elapsed
+
+
+@event.listens_for(Engine, "handle_error")
+def drop_query_timer(exception_context):
+    if exception_context.connection is not None and exception_context.connection.info.get("query_started"):
+        exception_context.connection.info["query_started"].pop()
+
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.setdefault("template_started", []).append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def record_template_time(sender, template, context, **extra):
+    if g.get("template_started"):
+        metrics.observe("template_render_seconds", time.perf_counter() - g.template_started.pop(),
+                        template=template.name)
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    if rate and random.random() < rate:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # Streamed pages render after the view returns, everything is measured once the response is closed.
+    # By then the request context may be gone, keep what is needed from it.
+    endpoint = request.endpoint or "unknown"
+    request_globals = g._get_current_object()
+    description = f"{request.method} {request.full_path}"
+    # Not the response itself, the callback would keep it (and its generator) alive in a cycle
+    status = response.status_code
+
+    def record():
+        metrics.observe("request_duration_seconds", time.perf_counter() - request_globals.request_started,
+                        endpoint=endpoint)
+        metrics.observe("db_duration_seconds", request_globals.get("query_time", 0), endpoint=endpoint)
+        metrics.observe("db_queries", request_globals.get("query_count", 0), endpoint=endpoint)
+        metrics.inc("requests_total", endpoint=endpoint, status=status)
+        profiler = request_globals.pop("profiler", None)
+        if profiler is not None:
+            profiler.disable()
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats("cumulative")\
+                .print_stats(app.config['PROFILE_TOP_FUNCTIONS'])
+            app.logger.warning("Profile of %s:\n%s", description, stream.getvalue())
+    response.call_on_close(record)
+    return response
+
+
+@app.after_request
+def check_query_budget(response):
+    # stream_page() renders the whole page up front while a budget is set, so the count is complete here
+    budget = app.config['QUERY_BUDGET']
+    if budget:
+        query_count = g.get("query_count", 0)
+        response.headers["X-Query-Count"] = str(query_count)
+        if query_count > budget:
+            message = f"{request.endpoint} ran {query_count} queries (budget {budget})"
+            if app.testing:
+                raise AssertionError(message)
+            app.logger.warning(message)
+    return response
+
+
+# Dialect specific INSERT supporting ON CONFLICT DO NOTHING
+upsert_inserts = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def resolve_tags(names):
+    # Turn tag names into Tag rows with one SELECT ... IN, plus one bulk insert for the new ones.
+    # Concurrent workers creating the same tag are absorbed by the unique index on tags.name.
+    names = list(dict.fromkeys(names))
+    if not names:
+        return []
+    tags = {tag.name: tag for tag in Tag.query.filter(Tag.name.in_(names))}
+    missing = [name for name in names if name not in tags]
+    if missing:
+        insert = upsert_inserts.get(db.session.get_bind().dialect.name)
+        if insert is None:
+            db.session.add_all([Tag(name=name) for name in missing])
+            db.session.flush()
+        else:
+            db.session.execute(insert(Tag).values([{"name": name} for name in missing])
+                               .on_conflict_do_nothing(index_elements=["name"]))
+        tags.update({tag.name: tag for tag in Tag.query.filter(Tag.name.in_(missing))})
+    return [tags[name] for name in names]
+
+
+def add_counts(model, keys, rows, **updates):
+    # INSERT ... ON CONFLICT DO UPDATE adding each row's post_count to the stored one, `updates` are the
+    # other columns to set on conflict as functions of the excluded (proposed) row
+    insert = upsert_inserts.get(db.session.get_bind().dialect.name)
+    if insert is None:
+        for row in rows:
+            stored = db.session.get(model, tuple(row[key] for key in keys))
+            if stored is None:
+                db.session.add(model(**row))
+                continue
+            stored.post_count += row["post_count"]
+            for column in updates:
+                if row[column] is not None:
+                    setattr(stored, column, row[column])
+        db.session.flush()
+        return
+    statement = insert(model).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=keys,
+        set_={"post_count": model.post_count + statement.excluded.post_count,
+              **{column: update(statement.excluded) for column, update in updates.items()}})
+    db.session.execute(statement)
+
+
+def update_tag_stats(old_tag_ids, new_tag_ids):
+    # Applies a post's tag change (creation: no old tags, deletion: no new ones) to tag_stats and tag_pairs,
+    # in the caller's transaction
+    old_tag_ids, new_tag_ids = set(old_tag_ids), set(new_tag_ids)
+    now = datetime.utcnow()
+    stats = [{"tag_id": tag_id, "post_count": 1, "last_used_at": now, "updated_at": now}
+             for tag_id in new_tag_ids - old_tag_ids]
+    stats += [{"tag_id": tag_id, "post_count": -1, "last_used_at": None, "updated_at": now}
+              for tag_id in old_tag_ids - new_tag_ids]
+    if not stats:
+        return
+    add_counts(TagStat, ["tag_id"], stats,
+               last_used_at=lambda excluded: db.func.coalesce(excluded.last_used_at, TagStat.last_used_at),
+               updated_at=lambda excluded: excluded.updated_at)
+    old_pairs = {(tag_id, other) for tag_id in old_tag_ids for other in old_tag_ids if tag_id != other}
+    new_pairs = {(tag_id, other) for tag_id in new_tag_ids for other in new_tag_ids if tag_id != other}
+    pairs = [{"tag_id": tag_id, "related_tag_id": other, "post_count": 1} for tag_id, other in new_pairs - old_pairs]
+    pairs += [{"tag_id": tag_id, "related_tag_id": other, "post_count": -1}
+              for tag_id, other in old_pairs - new_pairs]
+    if pairs:
+        add_counts(TagPair, ["tag_id", "related_tag_id"], pairs)
+        TagPair.query.filter(TagPair.tag_id.in_(old_tag_ids | new_tag_ids), TagPair.post_count <= 0)\
+            .delete(synchronize_session=False)
+
+
+def related_tags(tag_ids, limit=8):
+    # Tags most often found next to `tag_ids`, read from tag_pairs only
+    if not tag_ids:
+        return []
+    shared = db.func.sum(TagPair.post_count)
+    return db.session.query(Tag.id, Tag.name)\
+        .join(TagPair, TagPair.related_tag_id == Tag.id)\
+        .filter(TagPair.tag_id.in_(tag_ids), TagPair.related_tag_id.notin_(tag_ids))\
+        .group_by(Tag.id, Tag.name).order_by(shared.desc(), Tag.name).limit(limit).all()
+
+
 # Create admin-only decorator
 def admin_only(f):
     @wraps(f)
@@ -166,53 +593,501 @@ def admin_only(f):
 
 
 def project_owner_only(f):
+    # Loads the project, and the task when the route has one, in a single query restricted to the current user.
+    # The view gets them back from g.project / g.todo.
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        user_projects = [project.id for project in current_user.projects]
-        if kwargs["project_id"] not in user_projects:
+        if not current_user.is_authenticated:
             return abort(403)
+        todo_id = kwargs.get("todo_id", kwargs.get("index"))
+        project, todo = db.session.query(ToDoProject, ToDo)\
+            .outerjoin(ToDo, and_(ToDo.project_id == ToDoProject.id, ToDo.id == todo_id))\
+            .filter(ToDoProject.id == kwargs["project_id"], ToDoProject.author_id == current_user.id)\
+            .first() or (None, None)
+        if project is None:
+            return abort(403)
+        if todo_id is not None and todo is None:
+            return abort(404)
+        g.project = project
+        g.todo = todo
         return f(*args, **kwargs)
     return decorated_function
 
 
+def count_projects(user_id):
+    return db.session.query(db.func.count(ToDoProject.id)).filter(ToDoProject.author_id == user_id).scalar()
+
+
+def count_tasks(project_id):
+    return db.session.query(db.func.count(ToDo.id)).filter(ToDo.project_id == project_id).scalar()
+
+
+def lock_row(model, row_id):
+    # SELECT ... FOR UPDATE on the parent row serializes concurrent quota checks until commit (no-op on sqlite)
+    db.session.query(model.id).filter(model.id == row_id).with_for_update().one()
+
+
+def make_login_throttle_backend():
+    if app.config['LOGIN_THROTTLE'] == "memory":
+        return MemoryBuckets()
+    if app.config['LOGIN_THROTTLE'] == "sqlite":
+        return SqliteBuckets(app.config['LOGIN_THROTTLE_PATH'])
+    return None
+
+
+login_throttle = LoginThrottle(make_login_throttle_backend(),
+                               ip_burst=app.config['LOGIN_IP_BURST'], ip_per_minute=app.config['LOGIN_IP_PER_MINUTE'],
+                               email_burst=app.config['LOGIN_EMAIL_BURST'],
+                               email_per_minute=app.config['LOGIN_EMAIL_PER_MINUTE'])
+password_hasher = PasswordHasher(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_SALT_LENGTH'],
+                                 app.config['PASSWORD_HASH_THREADS'])
+
+
+def too_many_attempts(wait, template_name, **context):
+    flash("Too many attempts, try again in a few minutes.")
+    response = app.make_response((render_template(template_name, **context), 429))
+    response.headers["Retry-After"] = str(math.ceil(wait))
+    return response
+
+
+identity_cache = IdentityCache(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL'])
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    try:
+        key = parse_session_id(user_id)
+    except ValueError:
+        return None
+    user = identity_cache.get(key)
+    if user is None:
+        row = db.session.query(User.id, User.email, User.name, User.session_version).filter(User.id == key[0]).first()
+        # A session older than the user's version was logged out
+        if row is None or row.session_version != key[1]:
+            return None
+        user = CachedUser(*row)
+        identity_cache.set(key, user)
+    return user
+
+
+def bump_session_version(user_id):
+    db.session.query(User).filter(User.id == user_id)\
+        .update({User.session_version: User.session_version + 1}, synchronize_session=False)
+    identity_cache.discard(user_id)
+
+
+mail_sender = MailSender(app, db, OutgoingMail)
+
+
+def queue_mail(kind, subject, body, reply_to=None):
+    # Added to the current session, so the mail is only sent if the caller's transaction commits
+    db.session.add(OutgoingMail(kind=kind, subject=subject, body=body, reply_to=reply_to))
+
+
+@app.before_request
+def start_mail_sender():
+    mail_sender.ensure_started()
+
+
+@app.cli.command("send-mail")
+def send_mail():
+    """Deliver pending mails from the outbox once."""
+    mail_sender.run_once()
+    mail_sender.close()
+    dead = mail_sender.dead_count()
+    if dead:
+        click.echo(f"{dead} mail(s) gave up after {app.config['MAIL_MAX_ATTEMPTS']} attempts, "
+                   "see mail_outbox.last_error")
+
+
+@app.cli.command("rebuild-tag-stats")
+def rebuild_tag_stats():
+    """Recompute tag_stats and tag_pairs from tag_link."""
+    now = datetime.utcnow()
+    other_link = tag_link.alias("other_link")
+    TagPair.query.delete()
+    TagStat.query.delete()
+    db.session.execute(TagStat.__table__.insert().from_select(
+        ["tag_id", "post_count", "last_used_at", "updated_at"],
+        db.select(tag_link.c.tag_id, db.func.count(), db.func.max(BlogPost.updated_at), db.literal(now))
+        .join(BlogPost, BlogPost.id == tag_link.c.post_id).group_by(tag_link.c.tag_id)))
+    db.session.execute(TagPair.__table__.insert().from_select(
+        ["tag_id", "related_tag_id", "post_count"],
+        db.select(tag_link.c.tag_id, other_link.c.tag_id, db.func.count())
+        .join(other_link, and_(other_link.c.post_id == tag_link.c.post_id, other_link.c.tag_id != tag_link.c.tag_id))
+        .group_by(tag_link.c.tag_id, other_link.c.tag_id)))
+    db.session.commit()
+    page_cache.invalidate("tags")
+    click.echo(f"{TagStat.query.count()} tags, {TagPair.query.count()} tag pairs")
+
+
+@app.cli.command("set-password")
+@click.argument("email")
+@click.password_option()
+def set_password(email, password):
+    """Change a user's password, which logs out all their sessions."""
+    user = User.query.filter_by(email=email).first()
+    if user is None:
+        raise click.ClickException(f"No user {email}")
+    user.password = password_hasher.hash(password)
+    bump_session_version(user.id)
+    db.session.commit()
+
+
+@app.cli.command("render-content")
+@click.option("--batch-size", default=200, show_default=True, help="Rows rendered per transaction.")
+@click.option("--all", "render_all", is_flag=True, help="Render again the rows that already are.")
+def render_content(batch_size, render_all):
+    """Fill the rendered HTML, excerpt and reading time of posts and comments saved without them."""
+    posts = render_in_batches(BlogPost, BlogPost.body_html, lambda post: render_post_body(post, post.body),
+                              batch_size, render_all)
+    comments = render_in_batches(Comment, Comment.html, render_comment, batch_size, render_all)
+    # Cached pages still have the previous HTML
+    page_cache.clear()
+    click.echo(f"Rendered {posts} posts and {comments} comments")
+
+
+def render_in_batches(model, rendered_column, render, batch_size, render_all):
+    count, after = 0, 0
+    while True:
+        query = model.query.filter(model.id > after)
+        if not render_all:
+            query = query.filter(rendered_column.is_(None))
+        rows = query.order_by(model.id).limit(batch_size).all()
+        if not rows:
+            return count
+        for row in rows:
+            render(row)
+        after = rows[-1].id
+        db.session.commit()
+        count += len(rows)
+
+
+def export_page_versions():
+    # Every public blog page with a version built from what it shows, like the conditional GET validators
+    categories = db.session.query(db.func.count(BlogCategory.id), db.func.max(BlogCategory.updated_at)).one()
+    tags = db.session.query(db.func.count(TagStat.tag_id), db.func.max(TagStat.updated_at)).one()
+    posts = db.session.query(db.func.count(BlogPost.id), db.func.max(BlogPost.updated_at)).one()
+    common = (*categories, templates_changed_at, assets.version)
+    versions = {"/": utils.make_etag(*common, *posts), "/blog": utils.make_etag(*common),
+                "/tags": utils.make_etag(*common, *tags)}
+    for post_id, updated_at, category_updated_at in db.session.query(BlogPost.id, BlogPost.updated_at,
+                                                                     BlogCategory.updated_at)\
+            .outerjoin(BlogCategory, BlogPost.category_id == BlogCategory.id):
+        versions[f"/post/{post_id}"] = utils.make_etag(*common, *tags, updated_at, category_updated_at)
+    for category_id, updated_at, posts_updated_at, post_count in db.session.query(
+            BlogCategory.id, BlogCategory.updated_at, db.func.max(BlogPost.updated_at), db.func.count(BlogPost.id))\
+            .outerjoin(BlogPost, BlogPost.category_id == BlogCategory.id).group_by(BlogCategory.id):
+        versions[f"/category/{category_id}"] = utils.make_etag(*common, updated_at, posts_updated_at, post_count)
+    for tag_id, stats_updated_at, posts_updated_at, post_count in db.session.query(
+            tag_link.c.tag_id, TagStat.updated_at, db.func.max(BlogPost.updated_at), db.func.count(BlogPost.id))\
+            .join(BlogPost, BlogPost.id == tag_link.c.post_id).outerjoin(TagStat, TagStat.tag_id == tag_link.c.tag_id)\
+            .group_by(tag_link.c.tag_id, TagStat.updated_at):
+        versions[f"/tag/{tag_id}"] = utils.make_etag(*common, stats_updated_at, posts_updated_at, post_count)
+    return versions
+
+
+def setup_static_export():
+    # Runs in each export process: pages as an anonymous visitor sees them, listings on a single page, rendered
+    # from the database rather than the page cache. The comment form is replaced by a link to log in.
+    app.config['POSTS_PER_PAGE'] = app.config['COMMENTS_PER_PAGE'] = 1000000
+    page_cache.backend = None
+    app.jinja_env.globals.update(static_export=True)
+    with app.app_context():
+        # Connections inherited from the parent process stay with it
+        db.engine.dispose(close=False)
+    return app
+
+
+@app.cli.command("export-static")
+@click.argument("directory", type=click.Path(file_okay=False))
+@click.option("--full", is_flag=True, help="Render every page, not only the ones that changed.")
+@click.option("--jobs", type=int, default=None, help="Rendering processes (default: one per CPU).")
+@click.option("--base-url", default="", help="Site URL for the links to pages that aren't exported (login, search...).")
+def export_static(directory, full, jobs, base_url):
+    """Render the public blog pages to HTML files in DIRECTORY.
+
+    Links between exported pages are relative. DIRECTORY/manifest.json maps each URL to its file, a front server
+    can serve those and send the rest to the app. Later runs only render the pages whose content changed.
+    """
+    rendered, removed = exporter.export(directory, export_page_versions(), setup_static_export, jobs=jobs, full=full,
+                                        base_url=base_url)
+    click.echo(f"Rendered {rendered} pages, removed {removed}")
+
+
+@app.cli.command("vendor-assets")
+def vendor_assets():
+    """Download the CDN stylesheets, scripts and fonts into static/vendor."""
+    static_assets.vendor(app.static_folder)
+
+
+@app.cli.command("build-assets")
+def build_assets():
+    """Fingerprint, minify and precompress static files into static/dist."""
+    manifest = static_assets.build(app.static_folder)
+    # Cached pages point to the previous file names
+    page_cache.clear()
+    click.echo(f"{len(manifest)} files built")
+
+
+def audited_queries():
+    # The key query of each route, with placeholder values
+    return {
+        "login: user by email": User.query.filter_by(email="someone@example.com"),
+        "home: header posts": BlogPost.query.filter_by(header=True).order_by(BlogPost.id.desc()).limit(10),
+        "show_category: posts": BlogPost.query.filter_by(category_id=1).order_by(BlogPost.sort_key, BlogPost.id)
+        .limit(app.config['POSTS_PER_PAGE']),
+        "show_tag: posts": BlogPost.query.join(tag_link, tag_link.c.post_id == BlogPost.id)
+        .filter(tag_link.c.tag_id == 1).order_by(BlogPost.id).limit(app.config['POSTS_PER_PAGE']),
+        "show_post: tags": Tag.query.join(tag_link, tag_link.c.tag_id == Tag.id).filter(tag_link.c.post_id == 1),
+        "show_post: comments": Comment.query.filter_by(post_id=1).order_by(Comment.id.desc())
+        .limit(app.config['COMMENTS_PER_PAGE']),
+        "edit_post: tags by name": Tag.query.filter(Tag.name.in_(["python", "flask"])),
+        "show_post: related tags": db.session.query(TagPair.related_tag_id, db.func.sum(TagPair.post_count))
+        .filter(TagPair.tag_id.in_([1, 2])).group_by(TagPair.related_tag_id),
+        "show_profile: projects": ToDoProject.query.filter_by(author_id=1),
+        "show_todo: tasks": ToDo.query.filter_by(project_id=1),
+        "mail sender: pending mails": OutgoingMail.query.filter(OutgoingMail.sent_at.is_(None),
+                                                                OutgoingMail.next_attempt_at <= datetime.utcnow()),
+    }
+
+
+def explain(query):
+    # Returns the plan lines and the ones reading a whole table
+    dialect = db.session.get_bind().dialect
+    sql = str(query.statement.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+    if dialect.name == "postgresql":
+        plan = [row[0] for row in db.session.execute(db.text(f"EXPLAIN {sql}"))]
+        return plan, [line for line in plan if "Seq Scan" in line]
+    if dialect.name == "sqlite":
+        plan = [row[-1] for row in db.session.execute(db.text(f"EXPLAIN QUERY PLAN {sql}"))]
+        return plan, [line for line in plan if line.startswith("SCAN") and "INDEX" not in line]
+    raise click.ClickException(f"EXPLAIN is not supported for {dialect.name}")
+
+
+@app.cli.command("audit-indexes")
+@click.option("--verbose", is_flag=True, help="Print every plan, not only the ones with full scans.")
+def audit_indexes(verbose):
+    """Report route queries that read whole tables.
+
+    Postgres plans depend on table statistics: on tiny tables a sequential scan is expected,
+    run this against a database with realistic volumes."""
+    scans = 0
+    for name, query in audited_queries().items():
+        plan, full_scans = explain(query)
+        scans += len(full_scans)
+        click.echo(f"{'SCAN' if full_scans else 'ok  '} {name}")
+        for line in plan if verbose else full_scans:
+            click.echo(f"       {line}")
+    if scans:
+        raise click.ClickException(f"{scans} full table scan(s) found")
+
+
+maxime_pool = utils.MaximePool(loader=lambda: db.session.query(Maxime.id, Maxime.text).all(),
+                                ttl=app.config['MAXIME_CACHE_TTL'])
+
+
+def seed_maximes():
+    # The header always shows a maxime, make sure there is at least one to edit.
+    if not db.session.query(Maxime.id).first():
+        db.session.add(Maxime(text="Welcome!"))
+        db.session.commit()
+
+
+def load_search_posts(since):
+    query = db.session.query(BlogPost.id, BlogPost.title, BlogPost.subtitle, BlogPost.body_text, BlogPost.updated_at)
+    if since is not None:
+        # Posts saved within the same clock tick as `since` are simply indexed again
+        query = query.filter(BlogPost.updated_at >= since)
+    return query.yield_per(500)
+
+
+post_index = PostIndex(
+    load_state=lambda: tuple(db.session.query(db.func.count(BlogPost.id), db.func.max(BlogPost.updated_at)).one()),
+    load_posts=load_search_posts)
+
+# Ranks on the GIN indexed search_vector, snippets are only computed for the rows of the page
+POSTGRES_SEARCH = db.text(f"""
+    SELECT id, ts_headline('english', coalesce(body_text, ''), query,
+                           'StartSel="{HIGHLIGHT_START}", StopSel="{HIGHLIGHT_STOP}", MaxWords=35, MinWords=15')
+    FROM (SELECT id, body_text, query, ts_rank_cd(search_vector, query) AS rank
+          FROM blog_posts, websearch_to_tsquery('english', :terms) AS query
+          WHERE search_vector @@ query
+          ORDER BY rank DESC, id DESC
+          LIMIT :limit OFFSET :offset) AS page
+    ORDER BY rank DESC, id DESC
+""")
+
+
+def search_posts(terms, offset, limit):
+    # Returns ([SearchHit...], whether more results follow)
+    if db.session.get_bind().dialect.name != "postgresql":
+        return post_index.search(terms, offset, limit)
+    rows = db.session.execute(POSTGRES_SEARCH, {"terms": terms, "limit": limit + 1, "offset": offset}).all()
+    return [SearchHit(post_id, highlight(snippet)) for post_id, snippet in rows[:limit]], len(rows) > limit
+
+
+def page_cache_audience():
+    # The admin sees edit controls everywhere, their pages are never cached
+    if not current_user.is_authenticated:
+        return "anon"
+    if current_user.id == 1:
+        return None
+    return "user"
+
+
+def make_page_cache_backend():
+    if app.config['PAGE_CACHE'] == "memory":
+        return MemoryBackend(max_bytes=app.config['PAGE_CACHE_MAX_BYTES'])
+    if app.config['PAGE_CACHE'] == "filesystem":
+        return FileBackend(app.config['PAGE_CACHE_DIR'], max_bytes=app.config['PAGE_CACHE_MAX_BYTES'])
+    return None
+
+
+# Page cache hits repeat across visitors, their compressed bodies are kept under the page and maxime they show
+compression = Compression(app, cache_key=lambda: g.get("page_cache_variant"))
+images = ImageProxy(app)
+
+
+def stream_page(template_name, **context):
+    # The template renders while the response is sent, pieces are grouped so each write is worth a flush.
+    # With a QUERY_BUDGET the page is rendered before the headers, the queries of the body count too.
+    if app.config['QUERY_BUDGET']:
+        return render_template(template_name, **context)
+    return app.response_class(utils.group_chunks(stream_template(template_name, **context),
+                                                 app.config['STREAM_CHUNK_BYTES']), mimetype="text/html")
+
+
+MAXIME_HOLE = "<!--page-cache:maxime-->"
+CSRF_HOLE = "page-cache:csrf-token"
+
+page_cache = PageCache(make_page_cache_backend(), ttl=app.config['PAGE_CACHE_TTL'], audience=page_cache_audience)
+# The header maxime is random on every page and the comment form carries the visitor's own csrf token
+page_cache.add_hole(MAXIME_HOLE, lambda: str(escape(maxime_pool.pick().text)))
+page_cache.add_hole(CSRF_HOLE, generate_csrf, private=True,
+                    capture=lambda page, marker: page.replace(g.csrf_token, marker) if "csrf_token" in g else page)
+
+
+# Part of every ETag/Last-Modified, so a deploy with changed templates doesn't answer 304 with stale markup
+templates_changed_at = datetime.utcfromtimestamp(max(
+    os.path.getmtime(os.path.join(app.root_path, app.template_folder, name))
+    for name in os.listdir(os.path.join(app.root_path, app.template_folder))))
+
+
+def csrf_validator():
+    # Logged in pages carry forms: a cached copy must not outlive its csrf token, nor the session it was made for
+    if not current_user.is_authenticated:
+        return None
+    time_limit = app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    epoch = int(time.time() // time_limit) if time_limit else 0
+    return session.get(app.config.get('WTF_CSRF_FIELD_NAME', "csrf_token")), epoch
+
+
+def conditional(validators):
+    # Answers If-None-Match / If-Modified-Since with a 304 before the view queries and renders anything.
+    # `validators` receives the view arguments and returns the values the page depends on (its datetimes
+    # make Last-Modified), or None when the page doesn't exist (the view then runs and 404s).
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != "GET":
+                return f(*args, **kwargs)
+            values = validators(**kwargs)
+            if values is None:
+                return f(*args, **kwargs)
+            last_modified = max([templates_changed_at, *[value for value in values if isinstance(value, datetime)]])
+            last_modified = last_modified.replace(tzinfo=timezone.utc, microsecond=0)
+            etag = utils.make_etag(page_cache_audience() or "admin", request.full_path, templates_changed_at,
+                                   assets.version, csrf_validator(), *values)
+            # Weak comparison: compressed responses carry the weak form of the ETag
+            not_modified = request.if_none_match.contains_weak(etag) if request.if_none_match \
+                else bool(request.if_modified_since and request.if_modified_since >= last_modified)
+            response = app.response_class(status=304) if not_modified else app.make_response(f(*args, **kwargs))
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.no_cache = True
+            response.vary.add("Cookie")
+            return response
+        return decorated_function
+    return decorator
+
+
+def post_validators(index):
+    # Comments bump their post's updated_at, so post and category are enough, plus tag_stats for related tags
+    tags_changed_at = db.session.query(db.func.max(TagStat.updated_at)).scalar_subquery()
+    return db.session.query(BlogPost.updated_at, BlogCategory.updated_at, tags_changed_at)\
+        .outerjoin(BlogCategory, BlogPost.category_id == BlogCategory.id)\
+        .filter(BlogPost.id == index).first()
+
+
+def category_validators(index):
+    row = db.session.query(BlogCategory.updated_at, db.func.max(BlogPost.updated_at), db.func.count(BlogPost.id))\
+        .outerjoin(BlogPost, BlogPost.category_id == BlogCategory.id)\
+        .filter(BlogCategory.id == index).group_by(BlogCategory.id).first()
+    # The post count catches deletions, which leave no newer timestamp behind
+    return row
+
+
+def invalidate_post_pages(post_id, category_ids, tag_ids, tags_changed=False):
+    # `tags_changed`: tag_stats moved, which shows on the tag cloud and on every post's related tags
+    page_cache.invalidate("home", f"post:{post_id}", *[f"category:{category_id}" for category_id in category_ids],
+                          *[f"tag:{tag_id}" for tag_id in tag_ids], *(["tags"] if tags_changed else []))
 
 
 @app.context_processor
 def inject_now():
-    maximes = Maxime.query.all()
-    if len(maximes) > 0:
-        maxime = random.choice(maximes)
+    if g.get("page_cache_render"):
+        maxime = utils.CachedMaxime(id=None, text=Markup(MAXIME_HOLE))
     else:
-        maxime = Maxime(text="Welcome!")
-        db.session.add(maxime)
-        db.session.commit()
+        maxime = maxime_pool.pick()
     if current_user.is_authenticated:
         user_id = current_user.id
     else:
         user_id = 0
-    return dict(now=datetime.now(), user_id=user_id, maxime=maxime)
+    return dict(now=datetime.now(), user_id=user_id, maxime=maxime,
+                max_projects=app.config['TODO_MAX_PROJECTS'], max_tasks=app.config['TODO_MAX_TASKS'])
 
 
 # -------- Routes ---------
+@app.route("/metrics")
+def show_metrics():
+    token = app.config['METRICS_TOKEN']
+    has_token = token and request.headers.get("Authorization") == f"Bearer {token}"
+    if not has_token and not (current_user.is_authenticated and current_user.id == 1):
+        return abort(403)
+    return app.response_class(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/')
+@page_cache.cached(lambda: ["home", "categories"])
 def home():
-    last_post = db.session.query(BlogPost).order_by(BlogPost.id.desc()).first()
-    header_posts = BlogPost.query.filter_by(header=True).order_by(BlogPost.id.desc()).all()
+    last_post = BlogPost.query.options(*post_summary_options).order_by(BlogPost.id.desc()).first()
+    header_posts = BlogPost.query.options(*post_summary_options).filter_by(header=True)\
+        .order_by(BlogPost.id.desc()).all()
     return render_template("index.html", last_post=last_post, title="Welcome!", header_posts=header_posts)
 
 
 @app.route('/blog')
+@page_cache.cached(lambda: ["categories"])
 def blog_categories():
     categories = BlogCategory.query.all()
     return render_template("blog_categories.html", title="Blog categories", categories=categories)
 
 
 @app.route("/post/<int:index>", methods=["POST", "GET"])
+@conditional(post_validators)
+@page_cache.cached(lambda index: [f"post:{index}", "categories", "tags"])
 def show_post(index):
-    post = BlogPost.query.get(index)
+    after = request.args.get("after", type=int)
+    # Newest comments first
+    comments, next_after = seek_page(Comment.query.options(joinedload(Comment.author)).filter_by(post_id=index),
+                                     [Comment.id], after, app.config['COMMENTS_PER_PAGE'], descending=True)
+    if request.args.get("fragment"):
+        # Comments can only belong to an existing post, an empty page needs a look at the post itself
+        if not comments and not db.session.query(BlogPost.query.filter_by(id=index).exists()).scalar():
+            abort(404)
+        return render_template("comment-list.html", comments=comments, more_url=more_url(next_after, index=index))
+    post = BlogPost.query.options(*post_listing_options).filter_by(id=index).first_or_404()
     form = CommentForm()
     if form.validate_on_submit():
         if not current_user.is_authenticated:
@@ -220,38 +1095,81 @@ def show_post(index):
             return redirect(url_for('login'))
         comment = Comment(
             text=form.body.data,
-            author=current_user,
+            author_id=current_user.id,
             parent_post=post,
-            date=date.today().strftime("%B %d, %Y")
+            date=date.today()
         )
+        render_comment(comment)
+        # Comments are part of the post page, its validators must change too
+        post.updated_at = datetime.utcnow()
 
         db.session.add(comment)
+        queue_mail("comment", "from Blog",
+                   f"Comment added.\nPost : https://blog-sillikone.herokuapp.com/post/{post.id}")
         db.session.commit()
-        with smtplib.SMTP("smtp.gmail.com", 587) as connexion:
-            connexion.starttls()
-            connexion.login(user=os.environ.get("ADMIN_MAIL"), password=os.environ.get("MAIL_PASS"))
-            msg = f"subject: from Blog \n\nComment added.\nPost : https://blog-sillikone.herokuapp.com/post/{post.id}"
-            connexion.sendmail(from_addr=os.environ.get("ADMIN_MAIL"), to_addrs=os.environ.get("ADMIN_MAIL"),
-                               msg=msg.encode("utf8"))
+        page_cache.invalidate(f"post:{post.id}")
         return redirect(url_for("show_post", post=post, index=post.id))
-    return render_template("post.html", post=post, form=form)
+    return stream_page("post.html", post=post, form=form, comments=comments,
+                       related_tags=related_tags([tag.id for tag in post.tags]),
+                       more_url=more_url(next_after, index=index))
 
 
 @app.route("/category/<int:index>")
+@conditional(category_validators)
+@page_cache.cached(lambda index: [f"category:{index}", "categories"])
 def show_category(index):
-    category = BlogCategory.query.get(index)
-    posts = category.parent_posts
-    if category.name == "Nietzsche":
-        posts_title = utils.order_title_alphabetically(posts)
-        posts = [BlogPost.query.filter_by(title=title).first() for title in posts_title]
-    return render_template("category.html", category=category, posts=posts)
+    category = BlogCategory.query.get_or_404(index)
+    order_by = CATEGORY_ORDERINGS.get(category.ordering, CATEGORY_ORDERINGS["id"])
+    posts, next_after = seek_page(BlogPost.query.options(*post_summary_options).filter_by(category_id=category.id),
+                                  list(order_by), request.args.get("after", type=int),
+                                  app.config['POSTS_PER_PAGE'])
+    if request.args.get("fragment"):
+        return render_template("post-list.html", posts=posts, more_url=more_url(next_after, index=index))
+    return stream_page("category.html", category=category, posts=posts, more_url=more_url(next_after, index=index))
+
+
+@app.route("/tags")
+@page_cache.cached(lambda: ["tags"])
+def show_tags():
+    stats = db.session.query(Tag.id, Tag.name, TagStat.post_count).join(TagStat, TagStat.tag_id == Tag.id)\
+        .filter(TagStat.post_count > 0).order_by(Tag.name).all()
+    # Five font sizes on a log scale of the post count
+    most_used = max([stat.post_count for stat in stats], default=1)
+    cloud = [(stat, 1 + round(4 * math.log(stat.post_count) / math.log(most_used)) if most_used > 1 else 1)
+             for stat in stats]
+    return render_template("tags.html", title="Tags", cloud=cloud)
 
 
 @app.route("/tag/<int:index>")
+@page_cache.cached(lambda index: [f"tag:{index}", "categories", "tags"])
 def show_tag(index):
-    tag = Tag.query.get(index)
-    posts = tag.entries.all()
-    return render_template("tag.html", tag=tag, posts=posts)
+    tag, post_count = db.session.query(Tag, TagStat.post_count).outerjoin(TagStat, TagStat.tag_id == Tag.id)\
+        .filter(Tag.id == index).first_or_404()
+    posts, next_after = seek_page(BlogPost.query.options(*post_summary_options)
+                                  .join(tag_link, tag_link.c.post_id == BlogPost.id)
+                                  .filter(tag_link.c.tag_id == tag.id),
+                                  # Seeks and orders on tag_link, so ix_tag_link_tag_id serves both
+                                  [tag_link.c.post_id], request.args.get("after", type=int),
+                                  app.config['POSTS_PER_PAGE'])
+    if request.args.get("fragment"):
+        return render_template("post-list.html", posts=posts, more_url=more_url(next_after, index=index))
+    return stream_page("tag.html", tag=tag, post_count=post_count or 0, related_tags=related_tags([tag.id]),
+                       posts=posts, more_url=more_url(next_after, index=index))
+
+
+@app.route("/search")
+def search():
+    terms = request.args.get("q", "").strip()[:200]
+    page = max(request.args.get("page", 1, type=int), 1)
+    per_page = app.config['POSTS_PER_PAGE']
+    hits, has_more = search_posts(terms, (page - 1) * per_page, per_page) if terms else ([], False)
+    posts = {post.id: post for post in BlogPost.query.options(joinedload(BlogPost.category))
+             .filter(BlogPost.id.in_([hit.post_id for hit in hits]))}
+    results = [(posts[hit.post_id], hit.snippet) for hit in hits if hit.post_id in posts]
+    next_url = url_for("search", q=terms, page=page + 1) if has_more else None
+    if request.args.get("fragment"):
+        return render_template("search-results.html", results=results, more_url=next_url)
+    return render_template("search.html", terms=terms, results=results, more_url=next_url)
 
 
 @app.route("/new-post", methods=["POST", "GET"])
@@ -263,25 +1181,21 @@ def add_new_post():
     if form.validate_on_submit():
         new_post = BlogPost(
             title=form.title.data,
+            sort_key=utils.natural_sort_key(form.title.data),
             subtitle=form.subtitle.data,
-            body=form.body.data,
             img_url=form.img_url.data,
-            author=current_user,
+            author_id=current_user.id,
             header=form.header.data,
             category_id=form.category.data,
-            date=date.today().strftime("%B %d, %Y")
+            date=date.today()
         )
-        tags = form.tags.data.split()
-        new_post.tags = []
-        for tag in tags:
-            if Tag.query.filter_by(name=tag).first():
-                new_tag = Tag.query.filter_by(name=tag).first()
-            else:
-                new_tag = Tag(name=tag)
-                db.session.add(new_tag)
-            new_post.tags.append(new_tag)
+        render_post_body(new_post, form.body.data)
+        new_post.tags = resolve_tags(form.tags.data.split())
+        update_tag_stats([], [tag.id for tag in new_post.tags])
         db.session.add(new_post)
         db.session.commit()
+        invalidate_post_pages(new_post.id, [new_post.category_id], [tag.id for tag in new_post.tags],
+                              tags_changed=bool(new_post.tags))
         return redirect(url_for("home"))
     return render_template("make-post.html", form=form, title="New Post")
 
@@ -291,8 +1205,10 @@ def add_new_post():
 def delete_comment(index):
     comment = Comment.query.get(index)
     post = comment.parent_post
+    post.updated_at = datetime.utcnow()
     db.session.delete(comment)
     db.session.commit()
+    page_cache.invalidate(f"post:{post.id}")
     return redirect(url_for("show_post", index=post.id))
 
 
@@ -310,29 +1226,29 @@ def edit_post(index):
         img_url=post.img_url,
         tags=new_tags,
         category=post.category_id,
-        author=post.author,
         header=post.header,
         body=post.body
     )
     edit_form.category.choices = categories
     if edit_form.validate_on_submit():
+        old_category_id = post.category_id
+        old_tag_ids = [tag.id for tag in post.tags]
         post.title = edit_form.title.data
+        post.sort_key = utils.natural_sort_key(edit_form.title.data)
         post.subtitle = edit_form.subtitle.data
         post.img_url = edit_form.img_url.data
         post.category_id = edit_form.category.data
-        post.body = edit_form.body.data
+        render_post_body(post, edit_form.body.data)
         post.header = edit_form.header.data
-        tags = edit_form.tags.data.split()
-        post.tags = []
-        for tag in tags:
-            if Tag.query.filter_by(name=tag).first():
-                new_tag = Tag.query.filter_by(name=tag).first()
-            else:
-                new_tag = Tag(name=tag)
-                db.session.add(new_tag)
-            if post not in Tag.query.filter_by(name=tag).first().entries.all():
-                post.tags.append(new_tag)
+        # Tag changes only touch tag_link, which wouldn't trigger onupdate
+        post.updated_at = datetime.utcnow()
+        # The collection assignment only writes the tag_link rows that changed
+        post.tags = resolve_tags(edit_form.tags.data.split())
+        new_tag_ids = [tag.id for tag in post.tags]
+        update_tag_stats(old_tag_ids, new_tag_ids)
         db.session.commit()
+        invalidate_post_pages(post.id, {old_category_id, post.category_id}, set(old_tag_ids) | set(new_tag_ids),
+                              tags_changed=set(old_tag_ids) != set(new_tag_ids))
         return redirect(url_for("show_post", post=post, index=post.id))
     return render_template("make-post.html", form=edit_form)
 
@@ -341,8 +1257,11 @@ def edit_post(index):
 @admin_only
 def delete_post(index):
     post = BlogPost.query.get(index)
+    category_id, tag_ids = post.category_id, [tag.id for tag in post.tags]
+    update_tag_stats(tag_ids, [])
     db.session.delete(post)
     db.session.commit()
+    invalidate_post_pages(index, [category_id], tag_ids, tags_changed=bool(tag_ids))
     return redirect(url_for("home"))
 
 
@@ -354,9 +1273,11 @@ def add_category():
         new_category = BlogCategory(name=form.name.data,
                                     description=form.description.data,
                                     img_url=form.img_url.data,
+                                    ordering=form.ordering.data,
                                     )
         db.session.add(new_category)
         db.session.commit()
+        page_cache.invalidate("categories")
         return redirect(url_for("home"))
     return render_template("make-category.html", form=form, title="New Category")
 
@@ -368,12 +1289,15 @@ def edit_category(index):
     form = CreateCategoryForm(name=category.name,
                               description=category.description,
                               img_url=category.img_url,
+                              ordering=category.ordering,
                               )
     if form.validate_on_submit():
         category.name = form.name.data
         category.description = form.description.data
         category.img_url = form.img_url.data
+        category.ordering = form.ordering.data
         db.session.commit()
+        page_cache.invalidate("categories", f"category:{category.id}")
         return redirect(url_for("home"))
     return render_template("make-category.html", form=form, title="Edit Category")
 
@@ -386,6 +1310,7 @@ def add_maxime():
         new_maxime = Maxime(text=form.text.data)
         db.session.add(new_maxime)
         db.session.commit()
+        maxime_pool.invalidate()
         return redirect(url_for("home"))
     return render_template("make-maxime.html", form=form, title="Create Maxime")
 
@@ -398,22 +1323,29 @@ def edit_maxime(index):
     if form.validate_on_submit():
         maxime.text = form.text.data
         db.session.commit()
+        maxime_pool.invalidate()
         return redirect(url_for("home"))
     return render_template("make-maxime.html", form=form, index=index, title="Edit Maxime")
 
 
 @app.route("/new-project", methods=["POST", "GET"])
 def add_project():
-    projects_count = len(ToDoProject.query.filter_by(author=current_user).all())
-    if projects_count > 9:  # TODO: find a place to store as variable
+    if not current_user.is_authenticated:
+        flash("You must be logged in!")
+        return redirect(url_for('login'))
+    if count_projects(current_user.id) >= app.config['TODO_MAX_PROJECTS']:
         return redirect(url_for("show_profile"))
     form = CreateProject()
     if form.validate_on_submit():
+        lock_row(User, current_user.id)
+        if count_projects(current_user.id) >= app.config['TODO_MAX_PROJECTS']:
+            db.session.rollback()
+            return redirect(url_for("show_profile"))
         new_project = ToDoProject(
             name=form.name.data,
             description=form.description.data,
             img_url=form.img_url.data,
-            author=current_user,
+            author_id=current_user.id,
         )
         db.session.add(new_project)
         db.session.commit()
@@ -424,7 +1356,7 @@ def add_project():
 @app.route("/new-project/<int:project_id>", methods=["POST", "GET"])
 @project_owner_only
 def edit_project(project_id):
-    project = ToDoProject.query.get(project_id)
+    project = g.project
     form = CreateProject(
         name=project.name,
         description=project.description,
@@ -442,23 +1374,30 @@ def edit_project(project_id):
 @app.route("/delete-project/<int:project_id>", methods=["GET", "POST"])
 @project_owner_only
 def delete_project(project_id):
-    project = ToDoProject.query.get(project_id)
-    db.session.delete(project)
+    db.session.delete(g.project)
     db.session.commit()
-    return redirect(url_for("show_profile", items=current_user.projects))
+    return redirect(url_for("show_profile"))
 
 
 @app.route("/new-todo/<int:project_id>", methods=["POST", "GET"])
 @project_owner_only
 def add_todo(project_id):
-    project = ToDoProject.query.get(project_id)
+    project = g.project
+    if count_tasks(project.id) >= app.config['TODO_MAX_TASKS']:
+        flash("Too many tasks in project")
+        return redirect(url_for("show_todo", project_id=project.id))
     form = CreateToDo()
     if form.validate_on_submit():
+        lock_row(ToDoProject, project.id)
+        if count_tasks(project.id) >= app.config['TODO_MAX_TASKS']:
+            db.session.rollback()
+            flash("Too many tasks in project")
+            return redirect(url_for("show_todo", project_id=project.id))
         new_todo = ToDo(
             title=form.title.data,
             description=form.description.data,
             body=form.body.data,
-            author=current_user,
+            author_id=current_user.id,
             priority=form.priority_id.data,
             status=1,
             project=project,
@@ -473,7 +1412,7 @@ def add_todo(project_id):
 @app.route("/edit-todo/<int:index>/<int:project_id>", methods=["GET", "POST"])
 @project_owner_only
 def edit_todo(index, project_id):
-    todo = ToDo.query.get(index)
+    todo = g.todo
     edit_form = CreateToDo(
         title=todo.title,
         description=todo.description,
@@ -493,57 +1432,210 @@ def edit_todo(index, project_id):
 @app.route('/transfer_todo/<int:todo_id>/<int:new_project_id>/<int:project_id>', methods=["GET", "POST"])
 @project_owner_only
 def transfer_todo(todo_id, new_project_id, project_id):
-    new_project = ToDoProject.query.get(new_project_id)
-    if len(new_project.parent_todo_list) > 99:  # TODO: find a place to store as variable
+    new_project = ToDoProject.query.filter_by(id=new_project_id, author_id=current_user.id).first()
+    if new_project is None:
+        return abort(403)
+    lock_row(ToDoProject, new_project.id)
+    if count_tasks(new_project.id) >= app.config['TODO_MAX_TASKS']:
+        db.session.rollback()
         flash("Too many tasks in project")
         return redirect(url_for("show_todo", project_id=project_id))
-    todo = ToDo.query.get(todo_id)
-    current_project_id = todo.project_id
-    todo.project = new_project
+    g.todo.project = new_project
     db.session.commit()
-    return redirect(url_for("show_todo", project_id=current_project_id))
+    return redirect(url_for("show_todo", project_id=project_id))
 
 
 @app.route('/todo-list/<int:project_id>')
 @project_owner_only
 def show_todo(project_id):
-    project = ToDoProject.query.get(project_id)
-    projects_count = len(ToDoProject.query.filter_by(author=current_user).all())
-    todo_count = len(project.parent_todo_list)
-    return render_template("todo-list.html", project=project, projects_count=projects_count, todo_count=todo_count)
+    project = g.project
+    # Bodies are fetched from todo_body when a task is expanded
+    tasks = ToDo.query.options(defer(ToDo.body)).filter_by(project_id=project.id)\
+        .order_by(ToDo.priority.desc(), ToDo.id)
+    open_todos = tasks.filter_by(status=1).all()
+    closed_todos = tasks.filter_by(status=0).all()
+    projects = db.session.query(ToDoProject.id, ToDoProject.name).filter_by(author_id=current_user.id)\
+        .order_by(ToDoProject.id).all()
+    return render_template("todo-list.html", project=project, projects=projects, open_todos=open_todos,
+                           closed_todos=closed_todos, projects_count=len(projects), csrf_token=generate_csrf(),
+                           todo_count=len(open_todos) + len(closed_todos))
+
+
+@app.route('/todo-body/<int:index>/<int:project_id>')
+@project_owner_only
+def todo_body(index, project_id):
+    return jsonify(body=g.todo.body or "")
 
 
 @app.route("/delete-todo/<int:index>/<int:project_id>", methods=["GET", "POST"])
 @project_owner_only
 def delete_todo(index, project_id):
-    todo = ToDo.query.get(index)
-    db.session.delete(todo)
+    db.session.delete(g.todo)
     db.session.commit()
-    return redirect(url_for("show_todo", project_id=todo.project_id))
+    return redirect(url_for("show_todo", project_id=project_id))
 
 
 @app.route("/toggle-todo/<int:index>/<int:project_id>", methods=["GET", "POST"])
 @project_owner_only
 def toggle_todo_status(index, project_id):
-    todo = ToDo.query.get(index)
+    todo = g.todo
     if todo.status == 0:
         todo.status = 1
     else:
         todo.status = 0
     db.session.commit()
-    return redirect(url_for("show_todo", project_id=todo.project_id))
+    return redirect(url_for("show_todo", project_id=project_id))
+
+
+# JSON API used by the todo page, every change is a single request without a redirect or a page render
+TODO_API_FIELDS = {
+    "status": lambda value: isinstance(value, int) and not isinstance(value, bool) and value in (0, 1),
+    "priority": lambda value: isinstance(value, int) and not isinstance(value, bool) and value in (0, 1, 2),
+    "title": lambda value: isinstance(value, str) and 0 < len(value.strip()) <= 250,
+    "description": lambda value: value is None or isinstance(value, str) and len(value) <= 250,
+    "project_id": lambda value: isinstance(value, int) and not isinstance(value, bool),
+}
+
+
+def api_error(message, status=400):
+    return jsonify(error=message), status
+
+
+def todo_json(todo):
+    return {"id": todo.id, "project_id": todo.project_id, "title": todo.title, "description": todo.description,
+            "priority": todo.priority, "status": todo.status}
+
+
+def api_csrf_protect(f):
+    # Forms carry their token in the body, fetch() calls send it in the X-CSRFToken header
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if app.config.get('WTF_CSRF_ENABLED', True):
+            try:
+                validate_csrf(request.headers.get("X-CSRFToken"))
+            except ValidationError as error:
+                return api_error(str(error))
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def check_todo_changes(changes):
+    if not isinstance(changes, dict) or not changes:
+        return "Nothing to change"
+    for field, value in changes.items():
+        if field not in TODO_API_FIELDS:
+            return f"Unknown field: {field}"
+        if not TODO_API_FIELDS[field](value):
+            return f"Invalid value for {field}"
+    return None
+
+
+def apply_todo_operations(project, operations):
+    # Applies [{"id": .., "delete": true} or {"id": .., <field>: <value>...}] to tasks of `project`.
+    # Everything is checked before the first change so a rejected batch leaves the project untouched,
+    # the caller commits once for the whole batch.
+    changes = {}
+    for operation in operations:
+        if not isinstance(operation, dict) or not isinstance(operation.get("id"), int) \
+                or isinstance(operation["id"], bool):
+            return "Every operation needs a task id"
+        operation = dict(operation)
+        todo_id = operation.pop("id")
+        if operation.pop("delete", False) is True:
+            changes[todo_id] = None
+            continue
+        error = check_todo_changes(operation)
+        if error:
+            return error
+        changes[todo_id] = operation
+    todos = {todo.id: todo for todo in ToDo.query.options(defer(ToDo.body))
+             .filter(ToDo.project_id == project.id, ToDo.id.in_(changes))}
+    if len(todos) != len(changes):
+        return "Unknown task"
+
+    transfers = {}
+    for todo_id, change in changes.items():
+        if change and change.get("project_id", project.id) != project.id:
+            transfers.setdefault(change["project_id"], []).append(todo_id)
+    if transfers:
+        targets = ToDoProject.query.filter(ToDoProject.id.in_(transfers), ToDoProject.author_id == current_user.id)\
+            .order_by(ToDoProject.id).with_for_update().all()
+        if len(targets) != len(transfers):
+            return "Unknown project"
+        counts = dict(db.session.query(ToDo.project_id, db.func.count(ToDo.id))
+                      .filter(ToDo.project_id.in_(transfers)).group_by(ToDo.project_id))
+        for target_id, todo_ids in transfers.items():
+            if counts.get(target_id, 0) + len(todo_ids) > app.config['TODO_MAX_TASKS']:
+                return "Too many tasks in project"
+
+    for todo_id, change in changes.items():
+        todo = todos[todo_id]
+        if change is None:
+            db.session.delete(todo)
+            continue
+        for field, value in change.items():
+            setattr(todo, field, value.strip() if field == "title" else value)
+    return None
+
+
+def commit_todo_operations(project, operations):
+    error = apply_todo_operations(project, operations)
+    if error:
+        db.session.rollback()
+        return api_error(error, 409 if error == "Too many tasks in project" else 400)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return api_error("A task with this title already exists", 409)
+    return None
+
+
+@app.route("/api/projects/<int:project_id>/todos/<int:todo_id>", methods=["PATCH", "DELETE"])
+@project_owner_only
+@api_csrf_protect
+def api_todo(project_id, todo_id):
+    if request.method == "DELETE":
+        operation = {"id": todo_id, "delete": True}
+    else:
+        changes = request.get_json(silent=True)
+        error = check_todo_changes(changes)
+        if error:
+            return api_error(error)
+        operation = dict(changes, id=todo_id)
+    todo = g.todo
+    error = commit_todo_operations(g.project, [operation])
+    if error:
+        return error
+    if request.method == "DELETE":
+        return "", 204
+    return jsonify(todo_json(todo))
+
+
+@app.route("/api/projects/<int:project_id>/todos/batch", methods=["POST"])
+@project_owner_only
+@api_csrf_protect
+def api_todo_batch(project_id):
+    payload = request.get_json(silent=True)
+    operations = payload.get("operations") if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return api_error("Expected a list of operations")
+    if len(operations) > app.config['TODO_MAX_TASKS']:
+        return api_error("Too many operations")
+    error = commit_todo_operations(g.project, operations)
+    if error:
+        return error
+    return jsonify(applied=len(operations))
 
 
 @app.route("/contact", methods=["GET", "POST"])
 def contact():
     form = ContactForm()
     if form.validate_on_submit():
-        with smtplib.SMTP("smtp.gmail.com", 587) as connexion:
-            connexion.starttls()
-            connexion.login(user=os.environ.get("ADMIN_MAIL"), password=os.environ.get("MAIL_PASS"))
-            msg = f"subject: from user {form.name.data} \n\n{form.message.data}\n{form.email.data}"
-            connexion.sendmail(from_addr=form.email.data, to_addrs=os.environ.get("ADMIN_MAIL"),
-                               msg=msg.encode("utf8"))
+        queue_mail("contact", f"from user {form.name.data}", f"{form.message.data}\n{form.email.data}",
+                   reply_to=form.email.data)
+        db.session.commit()
+        mail_sender.wake()
         return render_template("contact.html", form=form, title="Successfully sent message!")
     return render_template("contact.html", form=form, title="Contact Me")
 
@@ -552,13 +1644,16 @@ def contact():
 def register():
     form = RegisterForm()
     if form.validate_on_submit():
+        wait = login_throttle.attempt(request.remote_addr)
+        if wait:
+            return too_many_attempts(wait, "register.html", form=form, title="Register")
         email = request.form.get("email")
         if not User.query.filter_by(email=email).first():
             password = request.form.get("password")
             name = request.form.get("name")
             user = User()
             user.email = email
-            user.password = generate_password_hash(password, salt_length=8)
+            user.password = password_hasher.hash(password)
             user.name = name
             db.session.add(user)
             db.session.commit()
@@ -571,11 +1666,18 @@ def register():
 @app.route('/login', methods=["GET", "POST"])
 def login():
     form = LoginForm()
-    if request.method == "POST":
-        email = request.form.get("email")
-        password = request.form.get("password")
+    if form.validate_on_submit():
+        email = form.email.data
+        password = form.password.data
+        # Refused before the hash is computed, that's the expensive part
+        wait = login_throttle.attempt(request.remote_addr, email)
+        if wait:
+            return too_many_attempts(wait, "login.html", form=form, title="Login")
         user = User.query.filter_by(email=email).first()
-        if user and check_password_hash(user.password, password):
+        if user and password_hasher.check(user.password, password):
+            if password_hasher.needs_rehash(user.password):
+                user.password = password_hasher.hash(password)
+                db.session.commit()
             login_user(user)
             return redirect(url_for('home'))
         else:
@@ -589,8 +1691,10 @@ def show_profile():
         flash("You must be logged in!")
         return redirect(url_for('login'))
     else:
-        projects_count = len(ToDoProject.query.filter_by(author=current_user).all())
-        return render_template("profile.html", title=current_user.name, projects_count=projects_count)
+        projects = db.session.query(ToDoProject.id, ToDoProject.name).filter_by(author_id=current_user.id)\
+            .order_by(ToDoProject.id).all()
+        return render_template("profile.html", title=current_user.name, projects=projects,
+                               projects_count=len(projects))
 
 
 @app.route('/logout')
@@ -601,8 +1705,9 @@ def logout():
 
 with app.app_context():
     db.create_all()
+    seed_maximes()
 
 if __name__ == "__main__":
     # app.run(debug=True)
-    http_server = WSGIServer(('127.0.0.1', 5000), app)
+    http_server = WSGIServer((os.environ.get("HOST", "127.0.0.1"), int(os.environ.get("PORT", 5000))), app)
     http_server.serve_forever()
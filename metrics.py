@@ -0,0 +1,79 @@
+import bisect
+import threading
+
+# Seconds, roughly doubling from 1ms to 10s
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    # In-process counters and histograms rendered in the Prometheus text format.
+    # Each gunicorn worker keeps its own, scrape them per worker or sum them in Prometheus.
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self._help = {}
+        self._histograms = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self._help[name] = ("histogram", help_text, buckets)
+
+    def counter(self, name, help_text):
+        self._help[name] = ("counter", help_text, None)
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self._help[name][2])
+            histogram.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, (kind, help_text, _) in self._help.items():
+                full_name = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {full_name} {help_text}")
+                lines.append(f"# TYPE {full_name} {kind}")
+                if kind == "counter":
+                    for (key_name, labels), value in self._counters.items():
+                        if key_name == name:
+                            lines.append(f"{full_name}{format_labels(labels)} {value}")
+                    continue
+                for (key_name, labels), histogram in self._histograms.items():
+                    if key_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+                        cumulative += count
+                        lines.append(f"{full_name}_bucket{format_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{full_name}_sum{format_labels(labels)} {histogram.sum}")
+                    lines.append(f"{full_name}_count{format_labels(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + "}"
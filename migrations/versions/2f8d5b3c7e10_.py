@@ -0,0 +1,68 @@
+"""tag statistics
+
+Revision ID: 2f8d5b3c7e10
+Revises: 7b4e2c9a1f63
+Create Date: 2026-10-18 14:48:27.915604
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f8d5b3c7e10'
+down_revision = '7b4e2c9a1f63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # main.py runs db.create_all() on import, so the tables may already exist (empty)
+    tables = sa.inspect(op.get_bind()).get_table_names()
+    if 'tag_stats' not in tables:
+        op.create_table('tag_stats',
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.Column('post_count', sa.Integer(), nullable=False),
+        sa.Column('last_used_at', sa.DateTime(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ),
+        sa.PrimaryKeyConstraint('tag_id')
+        )
+    if 'tag_pairs' not in tables:
+        op.create_table('tag_pairs',
+        sa.Column('tag_id', sa.Integer(), nullable=False),
+        sa.Column('related_tag_id', sa.Integer(), nullable=False),
+        sa.Column('post_count', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['related_tag_id'], ['tags.id'], ),
+        sa.ForeignKeyConstraint(['tag_id'], ['tags.id'], ),
+        sa.PrimaryKeyConstraint('tag_id', 'related_tag_id')
+        )
+
+    # Same as `flask rebuild-tag-stats`
+    tag_link = sa.table('tag_link', sa.column('post_id', sa.Integer), sa.column('tag_id', sa.Integer))
+    other_link = tag_link.alias('other_link')
+    blog_posts = sa.table('blog_posts', sa.column('id', sa.Integer), sa.column('updated_at', sa.DateTime))
+    tag_stats = sa.table('tag_stats', sa.column('tag_id', sa.Integer), sa.column('post_count', sa.Integer),
+                         sa.column('last_used_at', sa.DateTime), sa.column('updated_at', sa.DateTime))
+    tag_pairs = sa.table('tag_pairs', sa.column('tag_id', sa.Integer), sa.column('related_tag_id', sa.Integer),
+                         sa.column('post_count', sa.Integer))
+    op.execute(tag_pairs.delete())
+    op.execute(tag_stats.delete())
+    op.execute(tag_stats.insert().from_select(
+        ['tag_id', 'post_count', 'last_used_at', 'updated_at'],
+        sa.select(tag_link.c.tag_id, sa.func.count(), sa.func.max(blog_posts.c.updated_at),
+                  sa.literal(datetime.utcnow(), sa.DateTime))
+        .join(blog_posts, blog_posts.c.id == tag_link.c.post_id).group_by(tag_link.c.tag_id)))
+    op.execute(tag_pairs.insert().from_select(
+        ['tag_id', 'related_tag_id', 'post_count'],
+        sa.select(tag_link.c.tag_id, other_link.c.tag_id, sa.func.count())
+        .join(other_link, sa.and_(other_link.c.post_id == tag_link.c.post_id,
+                                  other_link.c.tag_id != tag_link.c.tag_id))
+        .group_by(tag_link.c.tag_id, other_link.c.tag_id)))
+
+
+def downgrade():
+    op.drop_table('tag_pairs')
+    op.drop_table('tag_stats')
@@ -0,0 +1,47 @@
+"""post sort key and category ordering
+
+Revision ID: 3f1c9a7d2b84
+Revises: 20851e664ccb
+Create Date: 2026-10-18 09:12:31.482113
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c9a7d2b84'
+down_revision = '20851e664ccb'
+branch_labels = None
+depends_on = None
+
+
+def natural_sort_key(title):
+    # Frozen copy of utils.natural_sort_key at the time of this migration
+    return re.sub(r"\d+", lambda match: match.group().zfill(10), title.replace("§", " "))
+
+
+def upgrade():
+    op.add_column('blog_posts', sa.Column('sort_key', sa.String(length=500), nullable=True))
+    op.add_column('blog_categories', sa.Column('ordering', sa.String(length=20), nullable=False,
+                                               server_default='id'))
+    op.create_index('ix_blog_posts_category_id_sort_key', 'blog_posts', ['category_id', 'sort_key'], unique=False)
+
+    connection = op.get_bind()
+    blog_posts = sa.table('blog_posts', sa.column('id', sa.Integer), sa.column('title', sa.String),
+                          sa.column('sort_key', sa.String))
+    blog_categories = sa.table('blog_categories', sa.column('name', sa.String), sa.column('ordering', sa.String))
+    for post_id, title in connection.execute(sa.select(blog_posts.c.id, blog_posts.c.title)).fetchall():
+        connection.execute(blog_posts.update().where(blog_posts.c.id == post_id)
+                           .values(sort_key=natural_sort_key(title)))
+    # Was hard coded in show_category
+    connection.execute(blog_categories.update().where(blog_categories.c.name == 'Nietzsche')
+                       .values(ordering='natural'))
+
+
+def downgrade():
+    op.drop_index('ix_blog_posts_category_id_sort_key', table_name='blog_posts')
+    op.drop_column('blog_categories', 'ordering')
+    op.drop_column('blog_posts', 'sort_key')
@@ -0,0 +1,25 @@
+"""session version of users
+
+Revision ID: 4e7a1c3b9d52
+Revises: 2f8d5b3c7e10
+Create Date: 2026-10-18 17:42:10.318452
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e7a1c3b9d52'
+down_revision = '2f8d5b3c7e10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing sessions only hold the user id, which is read as version 0
+    op.add_column('users', sa.Column('session_version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade():
+    op.drop_column('users', 'session_version')
@@ -0,0 +1,28 @@
+"""listing indexes for keyset pagination
+
+Revision ID: 5a0c8e7b3d19
+Revises: e4a9f27c18b6
+Create Date: 2026-10-18 12:02:47.153820
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5a0c8e7b3d19'
+down_revision = 'e4a9f27c18b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_blog_posts_category_id', 'blog_posts', ['category_id', 'id'], unique=False)
+    op.create_index('ix_tag_link_tag_id', 'tag_link', ['tag_id', 'post_id'], unique=False)
+    op.create_index('ix_comments_post_id', 'comments', ['post_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_comments_post_id', table_name='comments')
+    op.drop_index('ix_tag_link_tag_id', table_name='tag_link')
+    op.drop_index('ix_blog_posts_category_id', table_name='blog_posts')
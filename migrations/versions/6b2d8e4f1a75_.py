@@ -0,0 +1,33 @@
+"""rendered post and comment content
+
+Revision ID: 6b2d8e4f1a75
+Revises: 4e7a1c3b9d52
+Create Date: 2026-10-18 18:21:47.205913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b2d8e4f1a75'
+down_revision = '4e7a1c3b9d52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Filled by `flask render-content`, pages show the stored body until then
+    op.add_column('blog_posts', sa.Column('body_html', sa.Text(), nullable=True))
+    op.add_column('blog_posts', sa.Column('excerpt', sa.Text(), nullable=True))
+    op.add_column('blog_posts', sa.Column('word_count', sa.Integer(), nullable=True))
+    op.add_column('blog_posts', sa.Column('reading_minutes', sa.Integer(), nullable=True))
+    op.add_column('comments', sa.Column('html', sa.Text(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('comments', 'html')
+    op.drop_column('blog_posts', 'reading_minutes')
+    op.drop_column('blog_posts', 'word_count')
+    op.drop_column('blog_posts', 'excerpt')
+    op.drop_column('blog_posts', 'body_html')
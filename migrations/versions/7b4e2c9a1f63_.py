@@ -0,0 +1,84 @@
+"""post search text and postgres search vector
+
+Revision ID: 7b4e2c9a1f63
+Revises: c6e5a2f94b08
+Create Date: 2026-10-18 14:05:12.640381
+
+"""
+from html.parser import HTMLParser
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b4e2c9a1f63'
+down_revision = 'c6e5a2f94b08'
+branch_labels = None
+depends_on = None
+
+# Frozen copies of utils.strip_html and main.SEARCH_VECTOR_DDL at the time of this migration
+BLOCK_TAGS = {"address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt", "figcaption", "figure",
+              "footer", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "img", "li", "ol", "p", "pre", "section",
+              "table", "td", "th", "tr", "ul"}
+
+
+class TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skipping += 1
+        if tag in BLOCK_TAGS:
+            self.parts.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self._skipping:
+            self._skipping -= 1
+        if tag in BLOCK_TAGS:
+            self.parts.append(" ")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def strip_html(markup):
+    extractor = TextExtractor()
+    extractor.feed(markup or "")
+    extractor.close()
+    return " ".join("".join(extractor.parts).split())
+
+
+SEARCH_VECTOR_DDL = (
+    """ALTER TABLE blog_posts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(subtitle, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(body_text, '')), 'D')
+    ) STORED""",
+    "CREATE INDEX ix_blog_posts_search_vector ON blog_posts USING gin (search_vector)",
+)
+
+
+def upgrade():
+    op.add_column('blog_posts', sa.Column('body_text', sa.Text(), nullable=True))
+
+    connection = op.get_bind()
+    blog_posts = sa.table('blog_posts', sa.column('id', sa.Integer), sa.column('body', sa.Text),
+                          sa.column('body_text', sa.Text))
+    for post_id, body in connection.execute(sa.select(blog_posts.c.id, blog_posts.c.body)).fetchall():
+        connection.execute(blog_posts.update().where(blog_posts.c.id == post_id)
+                           .values(body_text=strip_html(body)))
+    if connection.dialect.name == 'postgresql':
+        for statement in SEARCH_VECTOR_DDL:
+            op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.drop_index('ix_blog_posts_search_vector', table_name='blog_posts')
+        op.drop_column('blog_posts', 'search_vector')
+    op.drop_column('blog_posts', 'body_text')
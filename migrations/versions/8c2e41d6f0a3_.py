@@ -0,0 +1,41 @@
+"""mail outbox
+
+Revision ID: 8c2e41d6f0a3
+Revises: 3f1c9a7d2b84
+Create Date: 2026-10-18 10:03:12.518940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c2e41d6f0a3'
+down_revision = '3f1c9a7d2b84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # main.py runs db.create_all() on import, so the table may already exist
+    if 'mail_outbox' in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table('mail_outbox',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('subject', sa.String(length=250), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('reply_to', sa.String(length=250), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sa.String(length=250), nullable=True),
+    sa.Column('sent_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_mail_outbox_pending', 'mail_outbox', ['sent_at', 'next_attempt_at'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_mail_outbox_pending', table_name='mail_outbox')
+    op.drop_table('mail_outbox')
@@ -0,0 +1,41 @@
+"""post sort key not null
+
+Revision ID: 8c4e2a6d9f31
+Revises: 6b2d8e4f1a75
+Create Date: 2026-10-18 21:04:12.538207
+
+"""
+import re
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e2a6d9f31'
+down_revision = '6b2d8e4f1a75'
+branch_labels = None
+depends_on = None
+
+
+def natural_sort_key(title):
+    # Frozen copy of utils.natural_sort_key at the time of this migration
+    return re.sub(r"\d+", lambda match: match.group().zfill(10), title.replace("§", " "))
+
+
+def upgrade():
+    # seek_page seeks on (sort_key, id), a NULL key would drop the post from natural ordered pages
+    connection = op.get_bind()
+    blog_posts = sa.table('blog_posts', sa.column('id', sa.Integer), sa.column('title', sa.String),
+                          sa.column('sort_key', sa.String))
+    missing = sa.select(blog_posts.c.id, blog_posts.c.title).where(blog_posts.c.sort_key.is_(None))
+    for post_id, title in connection.execute(missing).fetchall():
+        connection.execute(blog_posts.update().where(blog_posts.c.id == post_id)
+                           .values(sort_key=natural_sort_key(title)))
+    with op.batch_alter_table('blog_posts') as batch_op:
+        batch_op.alter_column('sort_key', existing_type=sa.String(length=500), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('blog_posts') as batch_op:
+        batch_op.alter_column('sort_key', existing_type=sa.String(length=500), nullable=True)
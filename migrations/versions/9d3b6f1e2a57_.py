@@ -0,0 +1,45 @@
+"""lookup and foreign key indexes
+
+Revision ID: 9d3b6f1e2a57
+Revises: 5a0c8e7b3d19
+Create Date: 2026-10-18 12:37:20.604418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3b6f1e2a57'
+down_revision = '5a0c8e7b3d19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_users_email', 'users', ['email'], unique=False)
+    op.create_index('ix_blog_posts_header', 'blog_posts', ['header', 'id'], unique=False)
+    op.create_index('ix_todo_list_project_id', 'todo_list', ['project_id'], unique=False)
+    op.create_index('ix_todo_projects_author_id', 'todo_projects', ['author_id'], unique=False)
+
+    # Duplicated links would violate the new primary key
+    op.execute("CREATE TABLE tag_link_distinct AS SELECT DISTINCT post_id, tag_id FROM tag_link "
+               "WHERE post_id IS NOT NULL AND tag_id IS NOT NULL")
+    op.execute("DELETE FROM tag_link")
+    op.execute("INSERT INTO tag_link (post_id, tag_id) SELECT post_id, tag_id FROM tag_link_distinct")
+    op.execute("DROP TABLE tag_link_distinct")
+    with op.batch_alter_table('tag_link') as batch_op:
+        batch_op.alter_column('post_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.alter_column('tag_id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_primary_key('pk_tag_link', ['post_id', 'tag_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('tag_link') as batch_op:
+        batch_op.drop_constraint('pk_tag_link', type_='primary')
+        batch_op.alter_column('tag_id', existing_type=sa.Integer(), nullable=True)
+        batch_op.alter_column('post_id', existing_type=sa.Integer(), nullable=True)
+    op.drop_index('ix_todo_projects_author_id', table_name='todo_projects')
+    op.drop_index('ix_todo_list_project_id', table_name='todo_list')
+    op.drop_index('ix_blog_posts_header', table_name='blog_posts')
+    op.drop_index('ix_users_email', table_name='users')
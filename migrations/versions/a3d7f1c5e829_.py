@@ -0,0 +1,29 @@
+"""todo listing index in priority order
+
+Revision ID: a3d7f1c5e829
+Revises: 8c4e2a6d9f31
+Create Date: 2026-10-18 22:37:05.914362
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d7f1c5e829'
+down_revision = '8c4e2a6d9f31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # show_todo orders by priority DESC, id ASC: an ascending priority column still needed a sort
+    op.drop_index('ix_todo_list_project_id_status', table_name='todo_list')
+    op.create_index('ix_todo_list_project_id_status', 'todo_list',
+                    ['project_id', 'status', sa.text('priority DESC'), 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_todo_list_project_id_status', table_name='todo_list')
+    op.create_index('ix_todo_list_project_id_status', 'todo_list', ['project_id', 'status', 'priority', 'id'],
+                    unique=False)
@@ -0,0 +1,32 @@
+"""unique tag names
+
+Revision ID: b71d0e93c5f2
+Revises: 8c2e41d6f0a3
+Create Date: 2026-10-18 10:41:55.207364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b71d0e93c5f2'
+down_revision = '8c2e41d6f0a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Merge duplicated tags into the oldest one before adding the unique index
+    op.execute("""
+        UPDATE tag_link SET tag_id = (
+            SELECT MIN(keep.id) FROM tags keep
+            WHERE keep.name = (SELECT dup.name FROM tags dup WHERE dup.id = tag_link.tag_id)
+        )
+    """)
+    op.execute("DELETE FROM tags WHERE id NOT IN (SELECT MIN(id) FROM tags GROUP BY name)")
+    op.create_index('ix_tags_name', 'tags', ['name'], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_tags_name', table_name='tags')
@@ -0,0 +1,25 @@
+"""todo listing index
+
+Revision ID: c6e5a2f94b08
+Revises: 9d3b6f1e2a57
+Create Date: 2026-10-18 13:20:44.377215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6e5a2f94b08'
+down_revision = '9d3b6f1e2a57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_todo_list_project_id_status', 'todo_list', ['project_id', 'status', 'priority', 'id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_todo_list_project_id_status', table_name='todo_list')
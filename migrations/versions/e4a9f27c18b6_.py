@@ -0,0 +1,75 @@
+"""real dates and updated_at timestamps
+
+Revision ID: e4a9f27c18b6
+Revises: b71d0e93c5f2
+Create Date: 2026-10-18 11:26:08.931547
+
+"""
+from datetime import date, datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a9f27c18b6'
+down_revision = 'b71d0e93c5f2'
+branch_labels = None
+depends_on = None
+
+DATE_FORMAT = "%B %d, %Y"
+
+
+def parse_date(value):
+    try:
+        return datetime.strptime(value.strip(), DATE_FORMAT).date()
+    except (AttributeError, ValueError):
+        return date.today()
+
+
+def convert_dates(table_name):
+    # "November 06, 2022" strings -> date column, updated_at starts at that date
+    op.add_column(table_name, sa.Column('date_value', sa.Date(), nullable=True))
+    op.add_column(table_name, sa.Column('updated_at', sa.DateTime(), nullable=True))
+    connection = op.get_bind()
+    table = sa.table(table_name, sa.column('id', sa.Integer), sa.column('date', sa.String),
+                     sa.column('date_value', sa.Date), sa.column('updated_at', sa.DateTime))
+    for row_id, value in connection.execute(sa.select(table.c.id, table.c.date)).fetchall():
+        day = parse_date(value)
+        connection.execute(table.update().where(table.c.id == row_id)
+                           .values(date_value=day, updated_at=datetime.combine(day, datetime.min.time())))
+    with op.batch_alter_table(table_name) as batch_op:
+        batch_op.drop_column('date')
+        batch_op.alter_column('date_value', new_column_name='date', existing_type=sa.Date(), nullable=False)
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def restore_dates(table_name):
+    op.add_column(table_name, sa.Column('date_text', sa.String(length=250), nullable=True))
+    connection = op.get_bind()
+    table = sa.table(table_name, sa.column('id', sa.Integer), sa.column('date', sa.Date),
+                     sa.column('date_text', sa.String))
+    for row_id, value in connection.execute(sa.select(table.c.id, table.c.date)).fetchall():
+        connection.execute(table.update().where(table.c.id == row_id)
+                           .values(date_text=value.strftime(DATE_FORMAT)))
+    with op.batch_alter_table(table_name) as batch_op:
+        batch_op.drop_column('updated_at')
+        batch_op.drop_column('date')
+        batch_op.alter_column('date_text', new_column_name='date', existing_type=sa.String(length=250),
+                              nullable=False)
+
+
+def upgrade():
+    convert_dates('blog_posts')
+    convert_dates('comments')
+    op.add_column('blog_categories', sa.Column('updated_at', sa.DateTime(), nullable=True))
+    op.execute(sa.text("UPDATE blog_categories SET updated_at = :now").bindparams(now=datetime.utcnow()))
+    with op.batch_alter_table('blog_categories') as batch_op:
+        batch_op.alter_column('updated_at', existing_type=sa.DateTime(), nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('blog_categories') as batch_op:
+        batch_op.drop_column('updated_at')
+    restore_dates('comments')
+    restore_dates('blog_posts')
@@ -0,0 +1,223 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import g, request, stream_with_context
+
+
+class MemoryBackend:
+    # LRU of rendered pages bounded by total size, only visible to the current worker.
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._pages = OrderedDict()
+        self._size = 0
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, ttl):
+        with self._lock:
+            entry = self._pages.get(key)
+            if entry is None:
+                return None
+            stored_at, page = entry
+            if time.time() - stored_at > ttl:
+                self._discard(key)
+                return None
+            self._pages.move_to_end(key)
+            return page
+
+    def set(self, key, page):
+        size = len(page)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._pages[key] = (time.time(), page)
+            self._size += size
+            while self._size > self.max_bytes:
+                self._discard(next(iter(self._pages)))
+
+    def _discard(self, key):
+        entry = self._pages.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry[1])
+
+    def version(self, dependency):
+        return self._versions.get(dependency, 0)
+
+    def bump(self, dependency):
+        self._versions[dependency] = time.time_ns()
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._size = 0
+
+
+class FileBackend:
+    # Pages and dependency versions stored as files, shared by every worker on the machine.
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.pages_dir = os.path.join(directory, "pages")
+        self.versions_dir = os.path.join(directory, "versions")
+        os.makedirs(self.pages_dir, exist_ok=True)
+        os.makedirs(self.versions_dir, exist_ok=True)
+        self._written = 0
+
+    @staticmethod
+    def _name(key):
+        return hashlib.sha1(key.encode("utf8")).hexdigest()
+
+    def get(self, key, ttl):
+        path = os.path.join(self.pages_dir, self._name(key))
+        try:
+            if time.time() - os.path.getmtime(path) > ttl:
+                return None
+            with open(path, encoding="utf8") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def set(self, key, page):
+        self._write(os.path.join(self.pages_dir, self._name(key)), page)
+        self._written += len(page)
+        # Only walk the directory once in a while
+        if self._written > self.max_bytes // 10:
+            self._written = 0
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.pages_dir):
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def version(self, dependency):
+        try:
+            with open(os.path.join(self.versions_dir, self._name(dependency)), encoding="utf8") as file:
+                return file.read()
+        except OSError:
+            return 0
+
+    def bump(self, dependency):
+        # A timestamp instead of a counter, so concurrent bumps don't need a read-modify-write
+        self._write(os.path.join(self.versions_dir, self._name(dependency)), str(time.time_ns()))
+
+    def clear(self):
+        for entry in os.scandir(self.pages_dir):
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _write(path, content):
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf8") as file:
+            file.write(content)
+        os.replace(temp_path, path)
+
+
+class PageCache:
+    # Caches rendered GET pages per route, arguments and audience.
+    # A cache key embeds the current version of every dependency the page declares ("post:3", "home"...),
+    # so invalidate() only has to bump versions and stale pages are simply never looked up again.
+    # Per-request parts of a page are left as hole markers and filled in on every hit: templates check
+    # `g.page_cache_render` to emit the marker, or `capture` swaps the rendered value for it afterwards.
+    # A hit sets `g.page_cache_variant` to the key and fill values its body is made of, unless a `private` hole
+    # (one value per visitor) was filled: other visitors will never get the same body.
+    def __init__(self, backend=None, ttl=300, audience=None):
+        self.backend = backend
+        self.ttl = ttl
+        self.audience = audience
+        self.holes = {}
+
+    def add_hole(self, marker, fill, capture=None, private=False):
+        self.holes[marker] = (fill, capture, private)
+
+    def invalidate(self, *dependencies):
+        if self.backend is not None:
+            for dependency in dependencies:
+                self.backend.bump(dependency)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def capture_holes(self, page):
+        for marker, (_, capture, _) in self.holes.items():
+            if capture is not None:
+                page = capture(page, marker)
+        return page
+
+    def _store_stream(self, key, chunks):
+        # Streamed pages are rendered while they are sent, stored once completely generated
+        parts = []
+        g.page_cache_render = True
+        try:
+            for chunk in chunks:
+                chunk = self.capture_holes(chunk)
+                parts.append(chunk)
+                yield self.fill_holes(chunk)
+        finally:
+            g.page_cache_render = False
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+        self.backend.set(key, "".join(parts))
+
+    def fill_holes(self, page, fills=None):
+        # `fills` collects the values used, None once a private hole is filled
+        for marker, (fill, _, private) in self.holes.items():
+            if marker in page:
+                value = fill()
+                page = page.replace(marker, value)
+                if fills is not None:
+                    fills.append(None if private else value)
+        return page
+
+    def cached(self, dependencies):
+        # `dependencies` receives the view arguments and returns the list of dependency names
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                audience = self.audience() if self.audience else "all"
+                if self.backend is None or request.method != "GET" or audience is None:
+                    return f(*args, **kwargs)
+                versions = ",".join(f"{dependency}={self.backend.version(dependency)}"
+                                    for dependency in dependencies(**kwargs))
+                key = f"{audience}|{request.full_path}|{versions}"
+                page = self.backend.get(key, self.ttl)
+                if page is None:
+                    g.page_cache_render = True
+                    page = f(*args, **kwargs)
+                    g.page_cache_render = False
+                    if getattr(page, "is_streamed", False):
+                        page.response = stream_with_context(self._store_stream(key, page.response))
+                        return page
+                    if not isinstance(page, str):
+                        return page
+                    page = self.capture_holes(page)
+                    self.backend.set(key, page)
+                fills = []
+                page = self.fill_holes(page, fills)
+                if None not in fills:
+                    g.page_cache_variant = (key, *fills)
+                return page
+            return decorated_function
+        return decorator
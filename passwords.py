@@ -0,0 +1,52 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+def gevent_patched():
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched("socket")
+
+
+class PasswordHasher:
+    # Hashes and checks passwords in a small thread pool. hashlib releases the GIL while it runs PBKDF2, so under
+    # gevent the hub keeps serving other requests, and with any worker at most `threads` hashes run at once.
+    def __init__(self, method="pbkdf2:sha256:260000", salt_length=16, threads=2):
+        self.method = method
+        self.salt_length = salt_length
+        self.threads = threads
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def _run(self, function, *args):
+        with self._lock:
+            # Pools don't survive a fork, each worker makes its own
+            if self._pool is None or self._pool_pid != os.getpid():
+                if gevent_patched():
+                    from gevent.threadpool import ThreadPool
+                    self._pool = ThreadPool(self.threads)
+                else:
+                    self._pool = ThreadPoolExecutor(self.threads, thread_name_prefix="password-hasher")
+                self._pool_pid = os.getpid()
+            pool = self._pool
+        if isinstance(pool, ThreadPoolExecutor):
+            return pool.submit(function, *args).result()
+        return pool.apply(function, args)
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method, self.salt_length)
+
+    def check(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        # "<method>$<salt>$<hash>", from werkzeug's generate_password_hash
+        method, _, rest = password_hash.partition("$")
+        salt = rest.partition("$")[0]
+        return method != self.method or len(salt) < self.salt_length
@@ -0,0 +1,135 @@
+import heapq
+import math
+import re
+import threading
+from collections import Counter, namedtuple
+
+from markupsafe import Markup, escape
+
+SearchHit = namedtuple("SearchHit", ["post_id", "snippet"])
+# Highlight markers around matched words, replaced by <mark> once the snippet is escaped
+HIGHLIGHT_START = "[[mark]]"
+HIGHLIGHT_STOP = "[[/mark]]"
+# Same weights as the postgres setweight() classes A, B and D
+FIELD_WEIGHTS = (3, 2, 1)
+MAX_QUERY_TERMS = 10
+SNIPPET_CHARS = 200
+WORD = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return [word for word in WORD.findall((text or "").lower()) if len(word) > 1]
+
+
+def highlight(snippet):
+    return Markup(str(escape(snippet)).replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_STOP, "</mark>"))
+
+
+def make_snippet(text, terms):
+    # Window of text around the first matched word, with every matched word highlighted
+    matches = [match for match in WORD.finditer(text) if match.group().lower() in terms]
+    start = max(matches[0].start() - SNIPPET_CHARS // 4, 0) if matches else 0
+    end = start + SNIPPET_CHARS
+    if start:
+        start = text.find(" ", start) + 1
+    if end < len(text):
+        end = text.rfind(" ", start, end) if " " in text[start:end] else end
+    parts, position = [], start
+    for match in matches:
+        if match.start() < start or match.end() > end:
+            continue
+        parts += [text[position:match.start()], HIGHLIGHT_START, match.group(), HIGHLIGHT_STOP]
+        position = match.end()
+    parts.append(text[position:end])
+    return ("… " if start else "") + "".join(parts) + (" …" if end < len(text) else "")
+
+
+class PostIndex:
+    # In-memory inverted index of the posts, the search backend when the database has no full-text search.
+    # `load_state` returns (post count, latest updated_at) and `load_posts(since)` the
+    # (id, title, subtitle, text, updated_at) rows changed since `since` (every post when None).
+    # Each search compares the state first, so edits made through other workers are picked up incrementally;
+    # a count that doesn't add up means posts were deleted and the index is rebuilt.
+    k1 = 1.2
+    b = 0.75
+
+    def __init__(self, load_state, load_posts):
+        self.load_state = load_state
+        self.load_posts = load_posts
+        self._state = None
+        self._postings = {}
+        self._terms = {}
+        self._lengths = {}
+        self._texts = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._state = None
+
+    def search(self, query, offset=0, limit=10):
+        terms = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TERMS]
+        if not terms:
+            return [], False
+        with self._lock:
+            self._sync()
+            postings = sorted((self._postings.get(term, {}) for term in terms), key=len)
+            # Every word has to match
+            candidates = set(postings[0]).intersection(*postings[1:])
+            if not candidates:
+                return [], False
+            average_length = sum(self._lengths.values()) / len(self._lengths)
+            weights = [(posting, math.log(1 + (len(self._lengths) - len(posting) + 0.5) / (len(posting) + 0.5)))
+                       for posting in postings]
+            scored = heapq.nlargest(offset + limit + 1, ((self._score(post_id, weights, average_length), post_id)
+                                                          for post_id in candidates))
+            hits = [SearchHit(post_id, highlight(make_snippet(self._texts[post_id], set(terms))))
+                    for _, post_id in scored[offset:offset + limit]]
+        return hits, len(scored) > offset + limit
+
+    def _score(self, post_id, weights, average_length):
+        # BM25
+        length_norm = self.k1 * (1 - self.b + self.b * self._lengths[post_id] / average_length)
+        score = 0
+        for posting, idf in weights:
+            frequency = posting[post_id]
+            score += idf * frequency * (self.k1 + 1) / (frequency + length_norm)
+        return score
+
+    def _sync(self):
+        count, updated_at = self.load_state()
+        if self._state == (count, updated_at):
+            return
+        since = self._state[1] if self._state else None
+        if since is None:
+            self._clear()
+        for post_id, title, subtitle, text, _ in self.load_posts(since):
+            self._remove(post_id)
+            self._add(post_id, (title, subtitle, text))
+        if len(self._lengths) != count:
+            self._clear()
+            for post_id, title, subtitle, text, _ in self.load_posts(None):
+                self._add(post_id, (title, subtitle, text))
+        self._state = (count, updated_at)
+
+    def _clear(self):
+        self._postings, self._terms, self._lengths, self._texts = {}, {}, {}, {}
+
+    def _add(self, post_id, fields):
+        frequencies = Counter()
+        for weight, field in zip(FIELD_WEIGHTS, fields):
+            for term in tokenize(field):
+                frequencies[term] += weight
+        for term, frequency in frequencies.items():
+            self._postings.setdefault(term, {})[post_id] = frequency
+        self._terms[post_id] = list(frequencies)
+        self._lengths[post_id] = sum(frequencies.values())
+        self._texts[post_id] = fields[2] or ""
+
+    def _remove(self, post_id):
+        for term in self._terms.pop(post_id, ()):
+            posting = self._postings[term]
+            del posting[post_id]
+            if not posting:
+                del self._postings[term]
+        self._lengths.pop(post_id, None)
+        self._texts.pop(post_id, None)
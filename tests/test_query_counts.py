@@ -0,0 +1,62 @@
+import os
+import sys
+import tempfile
+
+# main reads its configuration when imported: a throwaway database, every page rendered from it,
+# and X-Query-Count on every response (app.testing turns an exceeded budget into an AssertionError)
+os.environ.update(DATABASE_="sqlite:///" + os.path.join(tempfile.mkdtemp(), "queries.db"), SECRET_KEY="test",
+                  MAIL_SENDER="off", PAGE_CACHE="off", QUERY_BUDGET="30", LOGIN_THROTTLE="off")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+import main  # noqa: E402
+
+PAGES = {"home": "/", "show_post": "/post/1", "show_category": "/category/1", "show_tag": "/tag/1"}
+
+
+@pytest.fixture
+def client():
+    main.app.testing = True
+    with main.app.app_context():
+        main.db.drop_all()
+        main.db.create_all()
+        main.db.session.add(main.User(email="reader@example.com", password="-", name="Reader"))
+        main.db.session.add(main.BlogCategory(name="Aphorisms", description="Short ones"))
+        main.db.session.commit()
+    yield main.app.test_client()
+
+
+def add_posts(count, tags_per_post, comments_per_post):
+    with main.app.app_context():
+        offset = main.BlogPost.query.count()
+        tags = main.resolve_tags([f"tag{number}" for number in range(tags_per_post)])
+        for number in range(offset, offset + count):
+            post = main.BlogPost(title=f"Aphorism §{number}", sort_key=main.utils.natural_sort_key(f"§{number}"),
+                                 subtitle="Subtitle", category_id=1, author_id=1, header=True, tags=tags)
+            main.render_post_body(post, f"<p>Body of aphorism {number}</p>")
+            main.db.session.add(post)
+            main.db.session.flush()
+            main.db.session.add_all([main.Comment(text=f"Comment {comment}", author_id=1, post_id=post.id)
+                                     for comment in range(comments_per_post)])
+        main.db.session.commit()
+    main.app.test_cli_runner().invoke(args=["rebuild-tag-stats"])
+
+
+def query_counts(client):
+    counts = {}
+    for name, url in PAGES.items():
+        response = client.get(url)
+        assert response.status_code == 200, url
+        counts[name] = int(response.headers["X-Query-Count"])
+    return counts
+
+
+def test_query_counts_dont_grow_with_content(client):
+    add_posts(1, tags_per_post=1, comments_per_post=1)
+    # The first request also fills per-process caches (maximes)
+    query_counts(client)
+    small = query_counts(client)
+    # More posts in the category and the tag than a listing page holds, more tags and comments per post
+    add_posts(main.app.config['POSTS_PER_PAGE'] * 2, tags_per_post=5, comments_per_post=8)
+    assert query_counts(client) == small
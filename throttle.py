@@ -0,0 +1,107 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryBuckets:
+    # Token buckets of the current worker, the least recently used ones are dropped past max_keys
+    # (a dropped bucket was usually full again anyway).
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, limits, now=None):
+        # `limits` is a list of (key, capacity, refill per second). One token is taken from every bucket, or from
+        # none when one of them is empty; returns 0, or the seconds until that bucket has a token again.
+        now = time.time() if now is None else now
+        with self._lock:
+            levels = [refill(self._buckets.get(key), capacity, rate, now) for key, capacity, rate in limits]
+            wait = max((1 - tokens) / rate for tokens, (_, _, rate) in zip(levels, limits))
+            if wait > 0:
+                return wait
+            for tokens, (key, _, _) in zip(levels, limits):
+                self._buckets[key] = (tokens - 1, now)
+                self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return 0
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SqliteBuckets:
+    # The same buckets in a SQLite file, shared by every worker on the machine. Buckets untouched for max_age
+    # seconds are full again, they are deleted once in a while.
+    def __init__(self, path, max_age=3600):
+        self.path = path
+        self.max_age = max_age
+        self._takes = 0
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS buckets "
+                               "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+
+    def _connect(self):
+        # One connection per thread and process, sqlite connections can't cross either
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def take(self, limits, now=None):
+        now = time.time() if now is None else now
+        connection = self._connect()
+        # IMMEDIATE takes the write lock up front, no other worker reads the buckets in between
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            levels = []
+            for key, capacity, rate in limits:
+                row = connection.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (key,)).fetchone()
+                levels.append(refill(row, capacity, rate, now))
+            wait = max((1 - tokens) / rate for tokens, (_, _, rate) in zip(levels, limits))
+            if wait <= 0:
+                connection.executemany("INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)",
+                                       [(key, tokens - 1, now) for tokens, (key, _, _) in zip(levels, limits)])
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._takes += 1
+        if self._takes % 1000 == 0:
+            connection.execute("DELETE FROM buckets WHERE updated_at < ?", (now - self.max_age,))
+        return max(wait, 0)
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute("DELETE FROM buckets")
+
+
+def refill(bucket, capacity, rate, now):
+    if bucket is None:
+        return capacity
+    tokens, updated_at = bucket
+    return min(capacity, tokens + (now - updated_at) * rate)
+
+
+class LoginThrottle:
+    # Limits password checks per client IP and per account, before any hashing is done. Every attempt takes a
+    # token from both buckets, an empty one refuses the attempt with the seconds to wait.
+    def __init__(self, backend, ip_burst=20, ip_per_minute=10, email_burst=5, email_per_minute=2):
+        self.backend = backend
+        self.ip_limit = (ip_burst, ip_per_minute / 60)
+        self.email_limit = (email_burst, email_per_minute / 60)
+
+    def attempt(self, ip, email=None):
+        if self.backend is None:
+            return 0
+        limits = [(f"ip:{ip}", *self.ip_limit)]
+        if email:
+            limits.append((f"email:{email.strip().lower()}", *self.email_limit))
+        return self.backend.take(limits)
@@ -1,19 +1,104 @@
+import hashlib
+import random
+import re
+import threading
+import time
+from collections import namedtuple
+from html.parser import HTMLParser
 
-def order_title_alphabetically(posts):
-    posts_title = []
-    for post in posts:
-        split_str = post.title
-        if len(split_str.split("§")[1]) == 1:
-            posts_title.append(post.title.replace("§", " 000"))
-            continue
-        if len(split_str.split("§")[1]) == 2:
-            posts_title.append(post.title.replace("§", " 00"))
-            continue
-        if len(split_str.split("§")[1]) == 3:
-            posts_title.append(post.title.replace("§", " 0"))
-    posts_title.sort()
-    posts_title = [title.replace(" 000", "§") for title in posts_title]
-    posts_title = [title.replace(" 00", "§") for title in posts_title]
-    posts_title = [title.replace(" 0", "§") for title in posts_title]
-    return posts_title
 
+CachedMaxime = namedtuple("CachedMaxime", ["id", "text"])
+NATURAL_SORT_DIGITS = 10
+# Tags whose content is never shown as text
+SKIPPED_TAGS = {"script", "style"}
+# Tags that separate words, inline ones like <b> can sit in the middle of a word
+BLOCK_TAGS = {"address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt", "figcaption", "figure",
+              "footer", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "img", "li", "ol", "p", "pre", "section",
+              "table", "td", "th", "tr", "ul"}
+
+
+class MaximePool:
+    # Keeps (id, text) pairs in memory so the header can pick a maxime without hitting the db.
+    # Other gunicorn workers don't see our invalidations, so entries also expire after `ttl` seconds.
+    def __init__(self, loader, ttl=300, default_text="Welcome!"):
+        self.loader = loader
+        self.ttl = ttl
+        self.default = CachedMaxime(id=None, text=default_text)
+        self._maximes = None
+        self._loaded_at = 0
+        self._lock = threading.Lock()
+
+    def pick(self):
+        maximes = self._maximes
+        if maximes is None or time.monotonic() - self._loaded_at > self.ttl:
+            maximes = self.reload()
+        if not maximes:
+            return self.default
+        return random.choice(maximes)
+
+    def reload(self):
+        with self._lock:
+            self._maximes = [CachedMaxime(id=row[0], text=row[1]) for row in self.loader()]
+            self._loaded_at = time.monotonic()
+            return self._maximes
+
+    def invalidate(self):
+        self._maximes = None
+
+
+def make_etag(*parts):
+    return hashlib.sha1("|".join(str(part) for part in parts).encode("utf8")).hexdigest()
+
+
+def group_chunks(chunks, size):
+    # Joins the many small strings a streamed template yields into pieces of at least `size` characters
+    buffered, length = [], 0
+    try:
+        for chunk in chunks:
+            buffered.append(chunk)
+            length += len(chunk)
+            if length >= size:
+                yield "".join(buffered)
+                buffered, length = [], 0
+        if buffered:
+            yield "".join(buffered)
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def natural_sort_key(title):
+    # Zero-pad every number so "§2" sorts before "§10" with a plain string ORDER BY
+    return re.sub(r"\d+", lambda match: match.group().zfill(NATURAL_SORT_DIGITS), title.replace("§", " "))
+
+
+class TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            self._skipping += 1
+        if tag in BLOCK_TAGS:
+            self.parts.append(" ")
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS and self._skipping:
+            self._skipping -= 1
+        if tag in BLOCK_TAGS:
+            self.parts.append(" ")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def strip_html(markup):
+    # Plain text of a CKEditor body, whitespace collapsed
+    extractor = TextExtractor()
+    extractor.feed(markup or "")
+    extractor.close()
+    return " ".join("".join(extractor.parts).split())